@@ -0,0 +1,94 @@
+class BalanceIndex:
+    """Keeps per-address balances up to date so they don't have to be
+    recomputed from the whole chain on every lookup.
+
+    Attributes:
+        :received: coins received per address in mined blocks.
+        :sent: coins sent per address in mined blocks.
+        :pending: coins sent per address in open transactions.
+    """
+
+    def __init__(self):
+        self.received = {}
+        self.sent = {}
+        self.pending = {}
+
+    def clear(self):
+        """Forget every tracked balance."""
+        self.received = {}
+        self.sent = {}
+        self.pending = {}
+
+    def copy(self):
+        """Return an independent copy of the index."""
+        index = BalanceIndex()
+        index.received = dict(self.received)
+        index.sent = dict(self.sent)
+        index.pending = dict(self.pending)
+        return index
+
+    def rebuild(self, chain, open_transactions):
+        """Recompute the whole index from a chain and its open transactions.
+
+        Arguments:
+            :chain: The blocks to index.
+            :open_transactions: The transactions which are not mined yet.
+        """
+        self.clear()
+        for block in chain:
+            self.add_block(block)
+        for tx in open_transactions:
+            self.add_open_transaction(tx)
+
+    def add_block(self, block):
+        """Account for all transactions of a newly appended block.
+
+        Arguments:
+            :block: The block which was appended to the chain.
+        """
+        for tx in block.transactions:
+            self.sent[tx.sender] = self.sent.get(tx.sender, 0) + tx.amount
+            self.received[tx.recipient] = self.received.get(
+                tx.recipient, 0) + tx.amount
+
+    def remove_block(self, block):
+        """Undo add_block for a block which was removed from the chain.
+
+        Arguments:
+            :block: The block which was removed from the chain.
+        """
+        for tx in block.transactions:
+            self.sent[tx.sender] = self.sent.get(tx.sender, 0) - tx.amount
+            self.received[tx.recipient] = self.received.get(
+                tx.recipient, 0) - tx.amount
+
+    def add_open_transaction(self, transaction):
+        """Account for a transaction which is waiting to be mined.
+
+        Arguments:
+            :transaction: The open transaction.
+        """
+        self.pending[transaction.sender] = self.pending.get(
+            transaction.sender, 0) + transaction.amount
+
+    def remove_open_transaction(self, transaction):
+        """Stop accounting for a transaction which left the open transactions.
+
+        Arguments:
+            :transaction: The transaction which was mined or evicted.
+        """
+        self.pending[transaction.sender] = self.pending.get(
+            transaction.sender, 0) - transaction.amount
+
+    def clear_open_transactions(self):
+        """Drop all pending amounts (e.g. after they got mined)."""
+        self.pending = {}
+
+    def get_balance(self, participant):
+        """Return the balance of an address including its pending spendings.
+
+        Arguments:
+            :participant: The address (public key) to look up.
+        """
+        return (self.received.get(participant, 0) - self.sent.get(participant, 0)
+                - self.pending.get(participant, 0))
@@ -0,0 +1,93 @@
+"""Measures startup time and peak memory of starting a blockchain on a large
+chain: with eager and with lazy storage, which both replay the chain, and
+lazily from a state snapshot.
+
+Run from the project root with: python -m benchmarks.load_chain [blocks]
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+from balance_index import BalanceIndex
+from block import Block
+from blockchain import Blockchain
+from state_snapshot import StateSnapshot
+from storage import BlockLogStorage
+from transaction import Transaction
+from transaction_index import TransactionIndex
+
+# Number of blocks of the synthetic chain
+BLOCK_COUNT = 100000
+# Transactions per block, besides the mining reward
+TRANSACTIONS_PER_BLOCK = 2
+
+
+def storage_in(directory, lazy=False):
+    """Return a block log storage keeping its files in directory."""
+    return BlockLogStorage(os.path.join(directory, 'blockchain.log'),
+                           os.path.join(directory, 'blockchain.idx'),
+                           os.path.join(directory, 'open_transactions.log'),
+                           legacy_filename=None, sync_every=100000, lazy=lazy)
+
+
+def write_chain(directory, block_count):
+    """Write a synthetic chain (with fake keys and signatures) to directory."""
+    storage = storage_in(directory)
+    sender = '30819f300d06092a864886f70d010101050003818d00308189028181' + 'ab' * 131
+    recipient = '30819f300d06092a864886f70d010101050003818d00308189028181' + 'cd' * 131
+    previous_hash = ''
+    for index in range(block_count):
+        transactions = [Transaction(sender, recipient, 'ef' * 128, 1.5)
+                        for _ in range(TRANSACTIONS_PER_BLOCK)]
+        transactions.append(Transaction('MINING', sender, '', 10))
+        block = Block(index, previous_hash, transactions, index, index, 8)
+        storage.append_block(block)
+        previous_hash = block.hash
+    storage.close()
+
+
+def write_snapshot(directory):
+    """Write a snapshot of the state of the chain in directory."""
+    storage = storage_in(directory, lazy=True)
+    chain, _ = storage.load()
+    balances = BalanceIndex()
+    balances.rebuild(chain, ())
+    transaction_index = TransactionIndex()
+    transaction_index.rebuild(chain)
+    storage.save_snapshot(StateSnapshot(len(chain), chain[-1].hash, balances, transaction_index))
+    storage.close()
+
+
+def measure_startup(directory, mode):
+    """Start a blockchain on the chain in directory and print the startup
+    time and peak RSS."""
+    started = perf_counter()
+    blockchain = Blockchain(None, storage_in(directory, lazy=mode != 'eager'))
+    elapsed = perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{mode:>8}: started on {len(blockchain.chain)} blocks in {elapsed:.2f}s, '
+          f'peak RSS {peak_rss:.0f} MiB')
+    blockchain.storage.close()
+
+
+def run(block_count):
+    """Write a synthetic chain and measure the startup modes in fresh processes."""
+    with tempfile.TemporaryDirectory() as directory:
+        write_chain(directory, block_count)
+        for mode in ('eager', 'lazy', 'snapshot'):
+            if mode == 'snapshot':
+                write_snapshot(directory)
+            subprocess.run([sys.executable, '-m', 'benchmarks.load_chain',
+                            '--measure', directory, mode], check=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--measure':
+        measure_startup(sys.argv[2], sys.argv[3])
+    else:
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else BLOCK_COUNT)
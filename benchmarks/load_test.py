@@ -0,0 +1,152 @@
+"""Load tests the node with concurrent requests, from threads of one process
+and from several processes sharing the same storage, then checks that the
+chain and the balances are still consistent.
+
+Run from the project root with: python -m benchmarks.load_test [threads] [processes]
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+from time import perf_counter
+
+from utility import difficulty
+
+# Requests sent by every thread
+REQUESTS_PER_THREAD = 200
+# Amount of every transaction, small enough for the funds of a few blocks
+AMOUNT = 0.01
+# Recipient of every transaction
+RECIPIENT = 'load-test'
+# Blocks mined up front, so the wallet has funds
+FUNDING_BLOCKS = 3
+# One in this many requests mines a block, one in two adds a transaction
+MINE_EVERY = 50
+
+
+def load_node(directory):
+    """Import the node with its files in directory and return the module."""
+    # Blocks come in far faster than the target, keep the difficulty at the
+    # minimum so the test measures the node and not the proof of work
+    difficulty.TARGET_BLOCK_INTERVAL = 0
+    os.chdir(directory)
+    import node
+    node.app.testing = True
+    return node
+
+
+def send_requests(node, count, results):
+    """Send a mix of requests to the node and count them in results.
+
+    Arguments:
+        :node: The node module.
+        :count: The number of requests to send.
+        :results: A dict of counters shared by the threads of a process.
+    """
+    client = node.app.test_client()
+    accepted = 0
+    failed = 0
+    for number in range(count):
+        if number % MINE_EVERY == MINE_EVERY - 1:
+            node.blockchain.mine_block()
+        elif number % 2:
+            # Repeats of the same payment get their own nonce, so they are all accepted
+            response = client.post('/transaction', json={'recipient': RECIPIENT,
+                                                         'amount': AMOUNT})
+            if response.status_code == 201:
+                accepted += 1
+            else:
+                failed += 1
+        elif number % 4:
+            assert client.get('/balance').status_code == 200
+        else:
+            assert client.get('/chain?limit=20').status_code == 200
+    with results['lock']:
+        results['accepted'] += accepted
+        results['failed'] += failed
+        results['requests'] += count
+
+
+def run_threads(node, thread_count):
+    """Send requests from thread_count threads, returning the counters."""
+    results = {'lock': threading.Lock(), 'accepted': 0, 'failed': 0, 'requests': 0}
+    threads = [threading.Thread(target=send_requests,
+                                args=(node, REQUESTS_PER_THREAD, results))
+               for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def worker(project_root, directory, thread_count, queue):
+    """Run threads against a node of its own in a fresh process."""
+    sys.path.insert(0, project_root)
+    node = load_node(directory)
+    node.app.test_client().get('/wallet')
+    results = run_threads(node, thread_count)
+    queue.put((results['accepted'], results['failed'], results['requests']))
+
+
+def check(blockchain, accepted):
+    """Verify the chain and the balance index and that no transaction got lost."""
+    transactions = sum(1 for block in blockchain.chain for tx in block.transactions
+                       if tx.sender != 'MINING')
+    transactions += len(blockchain.get_open_transactions())
+    # The funding and mining requests don't add transactions
+    ok = (blockchain.verify_chain(full=True) and blockchain.verify_balances() == [] and
+          transactions == accepted)
+    print(f'  {len(blockchain.chain)} blocks, {transactions} transactions stored, '
+          f'{"consistent" if ok else "INCONSISTENT"}')
+    return ok
+
+
+def report(label, requests, accepted, failed, elapsed):
+    print(f'{label}: {requests} requests in {elapsed:.2f}s ({requests / elapsed:.0f} req/s), '
+          f'{accepted} transactions accepted, {failed} rejected')
+
+
+def run(thread_count, process_count):
+    project_root = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        node = load_node(directory)
+        client = node.app.test_client()
+        client.post('/wallet')
+        for _ in range(FUNDING_BLOCKS):
+            node.blockchain.mine_block()
+
+        started = perf_counter()
+        results = run_threads(node, thread_count)
+        report(f'{thread_count} threads', results['requests'], results['accepted'],
+               results['failed'], perf_counter() - started)
+        ok = check(node.blockchain, results['accepted'])
+
+        context = multiprocessing.get_context('spawn')
+        queue = context.Queue()
+        processes = [context.Process(target=worker,
+                                     args=(project_root, directory, thread_count, queue))
+                     for _ in range(process_count)]
+        started = perf_counter()
+        for process in processes:
+            process.start()
+        totals = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = perf_counter() - started
+        accepted = results['accepted'] + sum(total[0] for total in totals)
+        report(f'{process_count} processes x {thread_count} threads',
+               sum(total[2] for total in totals), sum(total[0] for total in totals),
+               sum(total[1] for total in totals), elapsed)
+        ok = check(node.blockchain, accepted) and ok
+        node.blockchain.storage.close()
+        os.chdir(project_root)
+    return ok
+
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    sys.exit(0 if run(threads, processes) else 1)
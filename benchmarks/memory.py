@@ -0,0 +1,89 @@
+"""Measures the memory held by a large chain and the size of its encodings.
+
+The slotted transactions with interned addresses (as mined transactions
+are kept) are compared with plain __dict__ based objects holding their own
+copy of every key, which is how transactions were stored before.
+
+Run from the project root with: python -m benchmarks.memory [blocks]
+"""
+
+import json
+import sys
+import tracemalloc
+
+from block import Block
+from transaction import Transaction
+from utility.codec import encode_transactions
+
+# Number of blocks of the synthetic chain
+BLOCK_COUNT = 10000
+# Transactions per block, besides the mining reward
+TRANSACTIONS_PER_BLOCK = 5
+# Number of distinct addresses sending coins to each other
+ADDRESS_COUNT = 50
+
+
+class PlainTransaction:
+    """A transaction stored the way it was before: a plain object with a __dict__."""
+
+    def __init__(self, sender, recipient, signature, amount):
+        self.sender = sender
+        self.recipient = recipient
+        self.amount = amount
+        self.signature = signature
+
+
+def make_chain_json(block_count):
+    """Return the JSON text of the transactions of a synthetic chain."""
+    keys = ['30819f300d06092a864886f70d010101050003818d00308189028181' + f'{key:02x}' * 131
+            for key in range(ADDRESS_COUNT)]
+    blocks = []
+    for index in range(block_count):
+        transactions = [{'sender': keys[(index + offset) % ADDRESS_COUNT],
+                         'recipient': keys[(index + offset + 1) % ADDRESS_COUNT],
+                         'amount': 1.5, 'signature': 'ef' * 128}
+                        for offset in range(TRANSACTIONS_PER_BLOCK)]
+        transactions.append({'sender': 'MINING', 'recipient': keys[index % ADDRESS_COUNT],
+                             'amount': 10, 'signature': ''})
+        blocks.append(transactions)
+    return json.dumps(blocks)
+
+
+def mined_transaction(sender, recipient, signature, amount):
+    """Create a transaction the way mined ones are kept."""
+    return Transaction(sender, recipient, signature, amount).intern_addresses()
+
+
+def measure(chain_json, transaction_class):
+    """Return the bytes held by a chain of transaction_class objects (or a
+    function creating them) loaded from JSON (decoding gives every transaction
+    its own copy of the strings)."""
+    tracemalloc.start()
+    block_dicts = json.loads(chain_json)
+    chain = [Block(index, '', [transaction_class(tx['sender'], tx['recipient'],
+                                                 tx['signature'], tx['amount'])
+                               for tx in transactions], index, index)
+             for index, transactions in enumerate(block_dicts)]
+    del block_dicts
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del chain
+    return size
+
+
+def run(block_count):
+    """Print the memory used by both representations and the encoded sizes."""
+    chain_json = make_chain_json(block_count)
+    plain = measure(chain_json, PlainTransaction)
+    slotted = measure(chain_json, mined_transaction)
+    print(f'{block_count} blocks: plain {plain / 2 ** 20:.1f} MiB, '
+          f'slotted {slotted / 2 ** 20:.1f} MiB')
+    block_dicts = json.loads(make_chain_json(min(block_count, 1000)))
+    json_size = sum(len(json.dumps(transactions)) for transactions in block_dicts)
+    binary_size = sum(len(encode_transactions([Transaction.from_dict(tx) for tx in transactions]))
+                      for transactions in block_dicts)
+    print(f'{len(block_dicts)} block bodies: JSON {json_size} bytes, binary {binary_size} bytes')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else BLOCK_COUNT)
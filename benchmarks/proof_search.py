@@ -0,0 +1,49 @@
+"""Compares the hash rate of Verification.valid_proof with ProofSearch.
+
+Run from the project root with: python -m benchmarks.proof_search
+"""
+
+from time import perf_counter
+
+from transaction import Transaction
+from utility.proof_search import ProofSearch
+from utility.verification import Verification
+
+# Number of pending transactions to benchmark
+TRANSACTION_COUNTS = [1, 100, 10000]
+# Seconds spent measuring each path
+DURATION = 1.0
+
+
+def make_transactions(count):
+    """Create count transactions with realistic key and signature sizes."""
+    sender = '30819f300d06092a864886f70d010101050003818d00308189028181' + 'ab' * 131
+    recipient = '30819f300d06092a864886f70d010101050003818d00308189028181' + 'cd' * 131
+    return [Transaction(sender, recipient, 'ef' * 128, index + 0.5) for index in range(count)]
+
+
+def measure(test_proof):
+    """Return the proofs per second test_proof manages in DURATION seconds."""
+    proof = 0
+    started = perf_counter()
+    while perf_counter() - started < DURATION:
+        for _ in range(10):
+            test_proof(proof)
+            proof += 1
+    return proof / (perf_counter() - started)
+
+
+def run():
+    """Print the hash rates of both paths for every transaction count."""
+    last_hash = 'f' * 64
+    for count in TRANSACTION_COUNTS:
+        transactions = make_transactions(count)
+        current = measure(lambda proof: Verification.valid_proof(transactions, last_hash, proof))
+        proof_search = ProofSearch.for_block(transactions, last_hash)
+        prefixed = measure(proof_search.is_valid)
+        print(f'{count:>6} transactions: valid_proof {current:>12.0f} hashes/s, '
+              f'ProofSearch {prefixed:>12.0f} hashes/s ({prefixed / current:.0f}x)')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,56 @@
+"""Compares the signing throughput of parsing the private key per signature
+(as /transaction used to) with the wallet's parsed signer.
+
+Run from the project root with: python -m benchmarks.signing
+"""
+
+import binascii
+from time import perf_counter
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+
+from wallet import Wallet
+
+# Number of transactions signed per path
+SIGNATURE_COUNT = 500
+# Size of the signed batches
+BATCH_SIZE = 50
+
+
+def sign_parsing_key(wallet, recipient, amount):
+    """Sign the way Wallet.sign_transaction did before keeping a parsed key."""
+    signer = PKCS1_v1_5.new(RSA.importKey(binascii.unhexlify(wallet.private_key)))
+    h = SHA256.new((str(wallet.public_key) + str(recipient) + str(amount)).encode('utf-8'))
+    return binascii.hexlify(signer.sign(h)).decode('ascii')
+
+
+def measure(label, sign_all):
+    """Run sign_all and print the signatures per second."""
+    started = perf_counter()
+    signatures = sign_all()
+    elapsed = perf_counter() - started
+    print(f'{label:>22}: {len(signatures) / elapsed:8.0f} signatures/s')
+    return signatures
+
+
+def run():
+    wallet = Wallet()
+    wallet.create_keys()
+    # Without nonces, so the signatures match the old signing path
+    payments = [(f'recipient-{index}', index + 0.5, None) for index in range(SIGNATURE_COUNT)]
+    before = measure('key parsed per call', lambda: [
+        sign_parsing_key(wallet, recipient, amount) for recipient, amount, _ in payments])
+    after = measure('sign_transaction', lambda: [
+        wallet.sign_transaction(wallet.public_key, recipient, amount, nonce)
+        for recipient, amount, nonce in payments])
+    batched = measure('sign_transactions', lambda: [
+        signature for start in range(0, len(payments), BATCH_SIZE)
+        for signature in wallet.sign_transactions(wallet.public_key,
+                                                  payments[start:start + BATCH_SIZE])])
+    assert before == after == batched
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,205 @@
+"""Benchmarks the hot paths of a node on a synthetic chain and writes the
+results as JSON, so runs on different commits can be compared.
+
+Run from the project root with:
+    python -m benchmarks.suite [--blocks N] [--transactions N] [--addresses N]
+                               [--seed N] [--repeat N] [--output results.json]
+Compare two result files with:
+    python -m benchmarks.suite --compare old.json new.json
+"""
+
+from argparse import ArgumentParser
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, time
+
+from benchmarks.synthetic import make_chain
+from blockchain import Blockchain
+from miner import Miner
+from storage import BlockLogStorage
+from utility.hash_util import hash_block, header_prefix
+from utility.verification import Verification
+import wallet as wallet_module
+
+# Difficulty of the proof of work benchmark (higher than the synthetic chain's,
+# so the search dominates the measurement)
+PROOF_DIFFICULTY = 14
+# Requests sent per run of each HTTP benchmark
+HTTP_REQUESTS = 20
+
+
+def measure(repeat, run, setup=None):
+    """Time run repeat times (calling setup untimed before each run) and
+    return the results in milliseconds per run."""
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = perf_counter()
+        run()
+        runs.append((perf_counter() - started) * 1000)
+    return {
+        'unit': 'ms',
+        'runs': runs,
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'mean': statistics.mean(runs)
+    }
+
+
+def measure_requests(repeat, send):
+    """Time HTTP_REQUESTS calls of send per run and return the milliseconds
+    per request."""
+    result = measure(repeat, lambda: [send(number) for number in range(HTTP_REQUESTS)])
+    for key in ('min', 'median', 'mean'):
+        result[key] /= HTTP_REQUESTS
+    result['runs'] = [run / HTTP_REQUESTS for run in result['runs']]
+    return result
+
+
+def benchmark_chain(chain, wallets, repeat):
+    """Benchmark hashing, proof of work and verification of the chain."""
+    results = {}
+    results['hash_block'] = measure(repeat, lambda: [hash_block(block) for block in chain])
+    results['proof_of_work'] = measure(
+        repeat, lambda: Miner().find_proof(header_prefix(
+            chain[-1].index, chain[-1].previous_hash, chain[-1].timestamp,
+            chain[-1].merkle_root, PROOF_DIFFICULTY), PROOF_DIFFICULTY))
+    results['verify_chain'] = measure(
+        repeat, lambda: Verification.verify_chain(chain),
+        # Verify every signature, not just look them up
+        setup=wallet_module.verified_signatures.clear)
+    return results
+
+
+def storage_in(directory):
+    return BlockLogStorage(os.path.join(directory, 'blockchain.log'),
+                           os.path.join(directory, 'blockchain.idx'),
+                           os.path.join(directory, 'open_transactions.log'),
+                           legacy_filename=None, lazy=True)
+
+
+def benchmark_blockchain(chain, wallets, repeat):
+    """Benchmark balances and persistence of a Blockchain holding the chain."""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        storage = storage_in(directory)
+        storage.save(chain, [])
+        blockchain = Blockchain(wallets[0].public_key, storage_in(directory))
+        keys = [wallet.public_key for wallet in wallets]
+        results['get_balance'] = measure(repeat, lambda: [blockchain.get_balance(key)
+                                                          for key in keys])
+        results['calculate_balance'] = measure(repeat, lambda: [
+            blockchain.calculate_balance(key) for key in keys])
+        results['save_data'] = measure(repeat, blockchain.save_data)
+        results['load_data'] = measure(repeat, blockchain.load_data)
+        blockchain.storage.close()
+        storage.close()
+    return results
+
+
+def benchmark_http(chain, wallets, repeat, seed):
+    """Benchmark the Flask routes with the test client of a node serving the chain."""
+    results = {}
+    project_root = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            storage = BlockLogStorage(legacy_filename=None)
+            storage.save(chain, [])
+            storage.close()
+            # The richest wallet sends the transactions
+            node_wallet = max(wallets, key=lambda wallet: sum(
+                tx.amount if tx.recipient == wallet.public_key else -tx.amount
+                for block in chain for tx in block.transactions
+                if wallet.public_key in (tx.sender, tx.recipient)))
+            node_wallet.save_keys()
+            import node
+            node.app.testing = True
+            client = node.app.test_client()
+            client.get('/wallet')
+            rng = random.Random(seed)
+            results['http_chain'] = measure_requests(repeat, lambda _: client.get('/chain'))
+            results['http_balance'] = measure_requests(repeat, lambda _: client.get('/balance'))
+            results['http_transaction'] = measure_requests(
+                repeat, lambda _: client.post('/transaction', json={
+                    'recipient': f'recipient-{rng.getrandbits(64):016x}', 'amount': 0.001}))
+            node.blockchain.storage.close()
+        finally:
+            os.chdir(project_root)
+    return results
+
+
+def git_commit():
+    """Return the commit the benchmarks run on (None outside of a git checkout)."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    started = perf_counter()
+    chain, wallets = make_chain(args.blocks, args.transactions, args.addresses, args.seed)
+    print(f'Generated {len(chain)} blocks in {perf_counter() - started:.1f}s', file=sys.stderr)
+    results = {}
+    results.update(benchmark_chain(chain, wallets, args.repeat))
+    results.update(benchmark_blockchain(chain, wallets, args.repeat))
+    results.update(benchmark_http(chain, wallets, args.repeat, args.seed))
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'time': time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': vars(args)
+        },
+        'results': results
+    }
+    for name, result in results.items():
+        print(f'{name:>18}: median {result["median"]:10.3f} ms, min {result["min"]:10.3f} ms',
+              file=sys.stderr)
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, mode='w', encoding='utf-8') as file:
+            file.write(output)
+
+
+def compare(old_filename, new_filename):
+    """Print the median of every benchmark in two result files and their ratio."""
+    with open(old_filename, mode='r', encoding='utf-8') as file:
+        old = json.load(file)['results']
+    with open(new_filename, mode='r', encoding='utf-8') as file:
+        new = json.load(file)['results']
+    for name in new:
+        if name in old:
+            ratio = new[name]['median'] / old[name]['median']
+            print(f'{name:>18}: {old[name]["median"]:10.3f} ms -> '
+                  f'{new[name]["median"]:10.3f} ms ({ratio:.2f}x)')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the hot paths of a node.')
+    parser.add_argument('--blocks', type=int, default=200)
+    parser.add_argument('--transactions', type=int, default=10,
+                        help='transactions per block, besides the mining reward')
+    parser.add_argument('--addresses', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='file to write the JSON results to (default stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files instead of running')
+    arguments = parser.parse_args()
+    if arguments.compare:
+        compare(*arguments.compare)
+    else:
+        run(arguments)
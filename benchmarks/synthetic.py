@@ -0,0 +1,82 @@
+"""Generates synthetic but valid chains for the benchmarks.
+
+Everything is derived from a seed: the keys, the transfers and the
+timestamps, and with them the proofs and hashes, so runs with the same
+parameters work on the same chain.
+"""
+
+import random
+
+from block import Block
+from blockchain import MINING_REWARD
+from miner import Miner
+from transaction import Transaction
+from utility.difficulty import TARGET_BLOCK_INTERVAL, next_difficulty
+from utility.hash_util import header_prefix
+from utility.merkle import merkle_root
+from wallet import Wallet
+
+# Timestamp of the first synthetic block (later ones come TARGET_BLOCK_INTERVAL
+# apart, so the difficulty stays the same)
+START_TIME = 1600000000
+# Largest amount of a synthetic transaction
+MAX_AMOUNT = 5
+
+
+def make_wallets(count, rng):
+    """Return count wallets with keys generated from rng (a random.Random)."""
+    wallets = []
+    for _ in range(count):
+        wallet = Wallet()
+        wallet.create_keys(rng.randbytes)
+        wallets.append(wallet)
+    return wallets
+
+
+def make_chain(block_count, transactions_per_block, address_count, seed):
+    """Return a valid chain with signed transfers between address_count
+    wallets, and the wallets.
+
+    Arguments:
+        :block_count: The number of blocks, including the genesis block.
+        :transactions_per_block: The transfers per block, besides the reward
+            (fewer while the wallets don't have the funds yet).
+        :address_count: The number of wallets sending coins to each other.
+        :seed: The seed everything is derived from.
+    """
+    rng = random.Random(seed)
+    wallets = make_wallets(address_count, rng)
+    balances = {wallet.public_key: 0 for wallet in wallets}
+    miner = Miner()
+    chain = [Block(0, '', [], 100, 0)]
+    for index in range(1, block_count):
+        transactions = []
+        # Like the node, count coins received in a block only once it is mined
+        received = []
+        for _ in range(transactions_per_block):
+            funded = [wallet for wallet in wallets if balances[wallet.public_key] >= 1]
+            if not funded:
+                break
+            sender = rng.choice(funded)
+            recipient = rng.choice(wallets).public_key
+            amount = rng.randint(1, min(MAX_AMOUNT, int(balances[sender.public_key])))
+            nonce = f'{rng.getrandbits(64):016x}'
+            signature = sender.sign_transaction(sender.public_key, recipient, amount, nonce)
+            transactions.append(Transaction(sender.public_key, recipient, signature, amount,
+                                            nonce))
+            balances[sender.public_key] -= amount
+            received.append((recipient, amount))
+        for recipient, amount in received:
+            balances[recipient] += amount
+        miner_key = rng.choice(wallets).public_key
+        balances[miner_key] += MINING_REWARD
+        transactions.append(Transaction('MINING', miner_key, '', MINING_REWARD))
+        previous_hash = chain[-1].hash
+        difficulty = next_difficulty(chain, index)
+        root = merkle_root([tx.transaction_id for tx in transactions])
+        timestamp = START_TIME + index * TARGET_BLOCK_INTERVAL
+        proof = miner.find_proof(header_prefix(index, previous_hash, timestamp, root, difficulty),
+                                 difficulty)
+        chain.append(Block(index, previous_hash, transactions, proof, timestamp, difficulty,
+                           merkle_root=root))
+    return chain, wallets
@@ -1,5 +1,8 @@
 from time import time
 from utility.printable import Printable
+from utility.hash_util import hash_block
+from transaction import Transaction
+from utility.fields import INTEGER, NUMBER, field
 
 
 class Block(Printable):
@@ -11,11 +14,128 @@ class Block(Printable):
         :timestamp: the timestamp of the block
         :transactions: a list of transactions which are included in the block.
         :proof: the proof of work number that yielded this block.
+        :difficulty: the leading zero bits the proof had to yield (None for
+            blocks mined before the difficulty was recorded).
+        :load_transactions: a function returning the transactions, used
+            instead of keeping them in memory when transactions is None.
+        :block_hash: the hash of the block if it is known, which is required
+            for a pruned block (one with neither transactions nor
+            load_transactions) since it can't be computed.
+        :merkle_root: the Merkle root of the transaction ids (None for blocks
+            mined before it was recorded, which are hashed and proven over
+            their transactions instead of their header).
+
+    Blocks are immutable, so their hash is computed once and then cached.
     """
+    __slots__ = ('index', 'previous_hash', 'timestamp', 'proof', 'difficulty', 'merkle_root',
+                 '__transactions', '__load_transactions', '__hash')
+
+    def __init__(self, index, previous_hash, transactions, proof, timestamp=None,
+                 difficulty=None, load_transactions=None, block_hash=None, merkle_root=None):
+        object.__setattr__(self, 'index', index)
+        object.__setattr__(self, 'previous_hash', previous_hash)
+        object.__setattr__(self, 'timestamp', time() if timestamp is None else timestamp)
+        object.__setattr__(self, '_Block__transactions',
+                           None if transactions is None else tuple(transactions))
+        object.__setattr__(self, '_Block__load_transactions', load_transactions)
+        object.__setattr__(self, 'proof', proof)
+        object.__setattr__(self, 'difficulty', difficulty)
+        object.__setattr__(self, 'merkle_root', merkle_root)
+        object.__setattr__(self, '_Block__hash', block_hash)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Blocks are immutable')
+
+    @property
+    def pruned(self):
+        """Whether the transactions of this block were dropped."""
+        return self.__transactions is None and self.__load_transactions is None
+
+    @property
+    def lazy(self):
+        """Whether the transactions of this block are loaded on every access."""
+        return self.__transactions is None and self.__load_transactions is not None
+
+    @property
+    def transactions(self):
+        """The transactions of this block (loaded from the storage, which
+        only caches the recently read ones, on every access for lazy blocks,
+        none for pruned blocks)."""
+        if self.__transactions is None:
+            if self.__load_transactions is None:
+                return ()
+            return tuple(self.__load_transactions())
+        return self.__transactions
+
+    @property
+    def hash(self):
+        """The (cached) hash of this block."""
+        if self.__hash is None:
+            object.__setattr__(self, '_Block__hash', hash_block(self))
+        return self.__hash
+
+    def to_dict(self):
+        """Converts this block into a (JSON serializable) dictionary."""
+        block = {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'timestamp': self.timestamp,
+            'transactions': [tx.to_dict() for tx in self.transactions],
+            'proof': self.proof
+        }
+        if self.difficulty is not None:
+            block['difficulty'] = self.difficulty
+        if self.merkle_root is not None:
+            block['merkle_root'] = self.merkle_root
+        if self.pruned:
+            block['pruned'] = True
+            block['hash'] = self.hash
+        return block
+
+    def to_header_dict(self):
+        """Converts everything but the transactions into a dictionary."""
+        header = {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'timestamp': self.timestamp,
+            'proof': self.proof
+        }
+        if self.difficulty is not None:
+            header['difficulty'] = self.difficulty
+        if self.merkle_root is not None:
+            header['merkle_root'] = self.merkle_root
+        if self.pruned:
+            header['pruned'] = True
+            header['hash'] = self.hash
+        return header
+
+    def without_transactions(self):
+        """Return a pruned copy of this block, which only keeps the header and the hash."""
+        if self.pruned:
+            return self
+        return Block(self.index, self.previous_hash, None, self.proof, self.timestamp,
+                     self.difficulty, block_hash=self.hash, merkle_root=self.merkle_root)
+
+    @staticmethod
+    def from_dict(block):
+        """Creates a block from a dictionary produced by to_dict, raising
+        KeyError if a field is missing, TypeError if it has the wrong type and
+        ValueError if the index is negative.
 
-    def __init__(self, index, previous_hash, transactions, proof, timestamp=None):
-        self.index = index
-        self.previous_hash = previous_hash
-        self.timestamp = time() if timestamp is None else timestamp
-        self.transactions = transactions
-        self.proof = proof
+        Arguments:
+            :block: The dictionary describing the block.
+        """
+        index = field(block, 'index', INTEGER)
+        if index < 0:
+            raise ValueError('Block index is negative')
+        previous_hash = field(block, 'previous_hash', str)
+        proof = field(block, 'proof', INTEGER)
+        timestamp = field(block, 'timestamp', NUMBER)
+        difficulty = field(block, 'difficulty', INTEGER, optional=True)
+        merkle_root = field(block, 'merkle_root', str, optional=True)
+        if block.get('pruned'):
+            return Block(index, previous_hash, None, proof, timestamp, difficulty,
+                         block_hash=field(block, 'hash', str), merkle_root=merkle_root)
+        transactions = [Transaction.from_dict(tx) for tx in field(block, 'transactions', list)]
+        return Block(index, previous_hash, transactions, proof, timestamp, difficulty,
+                     merkle_root=merkle_root)
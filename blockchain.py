@@ -1,141 +1,466 @@
+from collections import namedtuple
+from contextlib import contextmanager
 from functools import reduce
-import json
+import math
+import threading
 
-from utility.hash_util import hash_block
 from utility.verification import Verification
+from utility.difficulty import chain_work, next_difficulty
+from utility.event_bus import EventBus
+from utility.frozen_view import FrozenView
+from utility.hash_util import header_prefix
+from utility.merkle import merkle_root
+from utility.metrics import registry
+from utility.rwlock import ReadWriteLock
+from utility.timestamps import next_timestamp
 from block import Block
 from transaction import Transaction
 from wallet import Wallet
+from balance_index import BalanceIndex
+from mempool import Mempool, ORDER_BY_AMOUNT
+from state_snapshot import StateSnapshot
+from transaction_index import TransactionIndex
+from storage import BlockLogStorage
+from miner import Miner
 
 # Global variables
 MINING_REWARD = 10
+# Number of processes searching for a proof of work (1 mines inline)
+MINING_WORKERS = 1
+# Whether blocks are loaded without their transactions, which are read on access
+LAZY_LOADING = True
+# Known-good block hashes by height, blocks up to a matching checkpoint aren't verified
+CHECKPOINTS = {}
+# Maximum number of open transactions, the lowest ranked ones are evicted
+MEMPOOL_SIZE = 10000
+# Which open transactions are mined first (see mempool.py)
+MEMPOOL_ORDER = ORDER_BY_AMOUNT
+# Maximum number of transactions (besides the mining reward) in a block, blocks
+# of peers with more are rejected (the transaction index can't hold more than
+# 2 ** POSITION_BITS per block)
+MAX_BLOCK_TRANSACTIONS = 100
+# Blocks between two snapshots of the chain state (None writes no snapshots)
+SNAPSHOT_INTERVAL = 1000
+# Whether snapshots include the transaction index (otherwise it is rebuilt on startup)
+SNAPSHOT_TRANSACTION_INDEX = True
+# Blocks deeper than this lose their transactions once a snapshot covers them
+# (None keeps every transaction)
+PRUNE_DEPTH = None
+
+balance_seconds = registry.histogram('balance_lookup_seconds',
+                                     'Seconds spent looking up a balance.')
+storage_seconds = registry.histogram('storage_seconds',
+                                     'Seconds spent loading or saving the whole chain.')
+
+class BlockTemplate(namedtuple('BlockTemplate', ['transactions', 'previous_hash', 'difficulty',
+                                                 'generation', 'merkle_root', 'timestamp',
+                                                 'index'])):
+    """Everything a proof of work is searched for: the open transactions, the
+    hash of the last block, the difficulty, the generation of the blockchain
+    state, the Merkle root of the open transactions plus the mining reward,
+    the timestamp and the index of the block."""
+    __slots__ = ()
+
+    @property
+    def proof_prefix(self):
+        """The header of the block up to the proof, see Miner.find_proof."""
+        return header_prefix(self.index, self.previous_hash, self.timestamp,
+                             self.merkle_root, self.difficulty)
 
 
 class Blockchain:
-    """Blockchain class manages the chain of blocks as well as open transactions"""
+    """Blockchain class manages the chain of blocks as well as open transactions
+
+    Reads work on snapshots of the chain and the open transactions, which are
+    only ever appended to (or replaced as a whole), so any number of threads
+    can read while writes are serialized. With shared set, several processes
+    can use the same storage: writes lock out the other processes and every
+    access picks up what they changed first.
 
-    def __init__(self, hosting_node_id):
+    Changes are published on the events bus: a 'block' event per added block,
+    a 'transactions' event with the open transactions which were added and
+    removed (besides the mined ones) and a 'reset' event when the chain was
+    replaced by another process.
+    """
+
+    def __init__(self, hosting_node_id, storage=None, mining_workers=MINING_WORKERS,
+                 shared=False):
         # Our starting block for the blockchain
         genesis_block = Block(0, '', [], 100, 0)
         # Initializing (empty) blockchain
         self.chain = [genesis_block]
+        # Hash of the last block, so extending the chain never rehashes it
+        self.__tip_hash = genesis_block.hash
         # Unhandled transactions
-        self.__open_transactions = []
+        self.__mempool = Mempool(MEMPOOL_SIZE, MEMPOOL_ORDER)
+        # Per-address balances, kept in sync with the chain
+        self.__balances = BalanceIndex()
+        # Locations of the mined transactions by id and by address
+        self.__transaction_index = TransactionIndex()
+        # Where blocks and open transactions are persisted
+        self.storage = BlockLogStorage(lazy=LAZY_LOADING) if storage is None else storage
+        # Searches the proofs of work, reporting its hash rate
+        self.miner = Miner(mining_workers)
+        # Where the changes to the chain and the open transactions are published
+        self.events = EventBus()
+        # Lets readers in at the same time while writers take turns
+        self.__lock = ReadWriteLock()
+        self.__verify_lock = threading.Lock()
+        # Whether other processes write to the same storage
+        self.shared = shared
+        # Incremented whenever the chain or the open transactions change
+        self.__generation = 0
+        # Number of blocks known to be valid and the hash of the last of them
+        self.__verified_height = 0
+        self.__verified_hash = None
+        # Height of the last snapshot of the chain state
+        self.__snapshot_height = 0
         self.load_data()
         self.hosting_node = hosting_node_id
 
     @property
     def chain(self):
-        """Getter for the chain"""
-        return self.__chain[:]
+        """Getter for the chain (a read-only snapshot, nothing is copied)"""
+        self.refresh()
+        with self.__lock.read_lock():
+            return FrozenView(self.__chain)
 
     @chain.setter
     def chain(self, val):
         """Setter for the chain"""
-        self.__chain = val
+        self.__chain = list(val)
+
+    def get_tip_hash(self):
+        """Returns the hash of the last block"""
+        self.refresh()
+        return self.__tip_hash
 
     def get_open_transactions(self):
-        """Returns the open transactions"""
-        return self.__open_transactions[:]
+        """Returns the open transactions (a read-only snapshot)"""
+        self.refresh()
+        with self.__lock.read_lock():
+            return self.__mempool.transactions()
+
+    @contextmanager
+    def __write_access(self):
+        """Hold the write lock (and in shared mode the storage's process lock,
+        after picking up the changes of other processes)."""
+        with self.__lock.write_lock():
+            if self.shared:
+                with self.storage.process_lock():
+                    self.__refresh()
+                    yield
+            else:
+                yield
+
+    def refresh(self):
+        """Pick up blocks and open transactions other processes added to a
+        shared storage."""
+        if self.shared and self.storage.has_changed():
+            with self.__write_access():
+                pass
+
+    def __refresh(self):
+        changes = self.storage.refresh(FrozenView(self.__chain))
+        if changes is None:
+            return
+        blocks, open_transactions, reloaded = changes
+        previous_transactions = self.__mempool.transactions()
+        self.__mempool.replace(open_transactions)
+        if reloaded:
+            self.__chain = list(blocks)
+            self.__rebuild_state()
+            self.events.publish('reset', len(self.__chain), None)
+        else:
+            self.__chain.extend(blocks)
+            for block in blocks:
+                self.__balances.add_block(block)
+                self.__transaction_index.add_block(block)
+                self.events.publish('block', block.index + 1, block)
+            self.__publish_transaction_changes(previous_transactions, blocks)
+            self.__balances.clear_open_transactions()
+            for tx in self.__mempool.transactions():
+                self.__balances.add_open_transaction(tx)
+            if SNAPSHOT_INTERVAL and (len(self.__chain) // SNAPSHOT_INTERVAL >
+                                      self.__snapshot_height // SNAPSHOT_INTERVAL):
+                # The process which appended the blocks wrote the snapshot
+                self.__snapshot_height = len(self.__chain) // SNAPSHOT_INTERVAL * SNAPSHOT_INTERVAL
+        self.__tip_hash = self.__chain[-1].hash
+        self.__generation += 1
+
+    def __publish_transaction_changes(self, previous_transactions, blocks):
+        """Publish which open transactions were added and removed since they
+        were previous_transactions, not counting the ones mined in blocks."""
+        transactions = self.__mempool.transactions()
+        previous_ids = {tx.transaction_id for tx in previous_transactions}
+        current_ids = {tx.transaction_id for tx in transactions}
+        mined = {tx.transaction_id for block in blocks for tx in block.transactions}
+        added = [tx for tx in transactions if tx.transaction_id not in previous_ids]
+        removed = [tx for tx in previous_transactions
+                   if tx.transaction_id not in current_ids and tx.transaction_id not in mined]
+        if added or removed:
+            self.events.publish('transactions', len(self.__chain),
+                                {'added': added, 'removed': removed})
 
     def load_data(self):
-        """Initialize blockchain + open transactions data from a file."""
+        """Initialize blockchain + open transactions data from the storage."""
+        with storage_seconds.time(operation='load'), self.__write_access():
+            try:
+                chain, open_transactions = self.storage.load()
+                if chain:
+                    self.chain = chain
+                    self.__tip_hash = chain[-1].hash
+                else:
+                    self.storage.append_block(self.__chain[0])
+                # Transactions evicted before are evicted again
+                self.__mempool.replace(open_transactions)
+            except (IOError, ValueError):
+                print('Loading failed!')
+            finally:
+                self.__rebuild_state()
+                self.__generation += 1
+                print('Cleanup!')
+
+    def __rebuild_state(self):
+        """Rebuild the balances and the transaction index of the chain, from
+        the latest snapshot on if it belongs to the chain."""
         try:
-            with open('blockchain.txt', mode='r', encoding="utf-8") as file:
-                # file_content = pickle.loads(file.read())
-                file_content = file.readlines()
-                # BLOCKCHAIN = file_content['chain']
-                # OPEN_TRANSACTIONS = file_content['ot']
-                # Read the blockchain line without the '\n' special character
-                blockchain = json.loads(file_content[0][:-1])
-                updated_blockchain = []
-                for block in blockchain:
-                    coverted_tx = [Transaction(
-                        tx['sender'], tx['recipient'], tx['signature'],
-                        tx['amount']) for tx in block['transactions']]
-                    updated_block = Block(
-                        block['index'], block['previous_hash'],
-                        coverted_tx, block['proof'], block['timestamp'])
-                    updated_blockchain.append(updated_block)
-                self.chain = updated_blockchain
-                open_transactions = json.loads(file_content[1])
-                updated_transactions = []
-                for tx in open_transactions:
-                    updated_transaction = Transaction(
-                        tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
-                    updated_transactions.append(updated_transaction)
-                self.__open_transactions = updated_transactions
-        except (IOError, IndexError):
-            pass
-        finally:
-            print('Cleanup!')
+            snapshot = self.storage.load_snapshot()
+        except (IOError, ValueError):
+            print('Loading snapshot failed!')
+            snapshot = None
+        if snapshot is not None and (snapshot.height > len(self.__chain) or
+                                     self.__chain[snapshot.height - 1].hash != snapshot.tip_hash):
+            snapshot = None
+        if snapshot is None:
+            if len(self.__chain) > 1 and self.__chain[1].pruned:
+                print('Snapshot of the pruned blocks is missing!')
+            self.__snapshot_height = 0
+            self.__balances.rebuild(self.__chain, ())
+            self.__transaction_index.rebuild(self.__chain)
+        else:
+            # Only the blocks after the snapshot are replayed
+            self.__snapshot_height = snapshot.height
+            self.__balances = snapshot.balances
+            for block in self.__chain[snapshot.height:]:
+                self.__balances.add_block(block)
+            if snapshot.transaction_index is None:
+                self.__transaction_index.rebuild(self.__chain)
+            else:
+                self.__transaction_index = snapshot.transaction_index
+                for block in self.__chain[snapshot.height:]:
+                    self.__transaction_index.add_block(block)
+        for tx in self.__mempool.transactions():
+            self.__balances.add_open_transaction(tx)
 
-    def save_data(self):
-        """Save blockchain + open transactions snapshot to a file."""
+    def __save_snapshot(self):
+        """Persist a snapshot of the chain state and prune the blocks it makes
+        unnecessary (if PRUNE_DEPTH is set)."""
+        balances = self.__balances.copy()
+        balances.clear_open_transactions()
+        snapshot = StateSnapshot(len(self.__chain), self.__tip_hash, balances,
+                                 self.__transaction_index if SNAPSHOT_TRANSACTION_INDEX else None)
         try:
-            with open('blockchain.txt', mode='w', encoding="utf-8") as file:
-                saveable_chain = [block.__dict__ for block in [Block(
-                    block_el.index,
-                    block_el.previous_hash,
-                    [tx.__dict__ for tx in block_el.transactions],
-                    block_el.proof, block_el.timestamp) for block_el in self.__chain]]
-                file.write(json.dumps(saveable_chain))
-                file.write('\n')
-                saveable_tx = [tx.__dict__ for tx in self.__open_transactions]
-                file.write(json.dumps(saveable_tx))
-                # save_data = {
-                #     'chain': blockchain,
-                #     'ot': OPEN_TRANSACTIONS
-                # }
-                # file.write(pickle.dumps(save_data))
+            if not self.storage.save_snapshot(snapshot):
+                return
         except IOError:
-            print('Saving failed!')
-
-    def proof_of_work(self):
-        """Generate a proof of work for the open transactions, the hash of the
-        previous block and a random number (which is guessed until it fits)."""
-        last_block = self.__chain[-1]
-        last_hash = hash_block(last_block)
-        nonce = 0
-        while not Verification.valid_proof(self.__open_transactions, last_hash, nonce):
-            nonce += 1
-        return nonce
-
-    def get_balance(self):
-        """Calculate and return the balance for a participant."""
-        if self.hosting_node is None:
-            return None
-        participant = self.hosting_node
+            print('Saving snapshot failed!')
+            return
+        self.__snapshot_height = snapshot.height
+        if PRUNE_DEPTH is None:
+            return
+        # Balances of pruned blocks can only come from a snapshot
+        height = min(self.__snapshot_height, len(self.__chain) - PRUNE_DEPTH)
+        if height <= 1 or self.__chain[height - 1].pruned:
+            return
+        try:
+            self.storage.prune(self.__chain, height)
+        except IOError:
+            print('Pruning failed!')
+            return
+        # Readers keep their snapshot of the unpruned chain
+        self.__chain = self.storage.rebind(
+            [block.without_transactions() for block in self.__chain[:height]] +
+            self.__chain[height:])
+
+    def __after_blocks_added(self):
+        """Write a snapshot whenever the chain crossed a multiple of SNAPSHOT_INTERVAL."""
+        if SNAPSHOT_INTERVAL and (len(self.__chain) // SNAPSHOT_INTERVAL >
+                                  self.__snapshot_height // SNAPSHOT_INTERVAL):
+            self.__save_snapshot()
+
+    def save_data(self):
+        """Save a full blockchain + open transactions snapshot to the storage."""
+        with storage_seconds.time(operation='save'), self.__write_access():
+            try:
+                self.storage.save(self.__chain, self.__mempool.transactions())
+                self.__chain = self.storage.rebind(self.__chain)
+            except IOError:
+                print('Saving failed!')
+
+    def set_hosting_node(self, hosting_node_id):
+        """Switch the node (wallet) the balance and the mining rewards are for."""
+        with self.__write_access():
+            self.hosting_node = hosting_node_id
+            self.__generation += 1
+
+    def verify_chain(self, full=False):
+        """Verify the blocks appended since the last verification and return
+        True if the chain is valid, False otherwise.
+
+        Everything is verified again (down to the highest matching checkpoint)
+        if full is set, or if the chain changed below the verified height.
+
+        Arguments:
+            :full: Whether to ignore the previous verification.
+        """
+        chain = self.chain
+        # Verifying works on the snapshot, so it doesn't hold up other requests
+        with self.__verify_lock:
+            if (full or self.__verified_height == 0 or self.__verified_height > len(chain) or
+                    chain[self.__verified_height - 1].hash != self.__verified_hash):
+                start = 1
+                for height, checkpoint_hash in sorted(CHECKPOINTS.items()):
+                    if height >= len(chain):
+                        break
+                    if chain[height].hash != checkpoint_hash:
+                        print('Checkpoint mismatch')
+                        return False
+                    start = height + 1
+            else:
+                start = self.__verified_height
+            if not Verification.verify_chain(chain, start):
+                return False
+            self.__verified_height = len(chain)
+            self.__verified_hash = chain[-1].hash
+            return True
+
+    def get_next_difficulty(self):
+        """Return the difficulty the next block has to be mined with."""
+        return next_difficulty(self.__chain, len(self.__chain))
+
+    def get_balance(self, sender=None):
+        """Return the balance of a participant from the balance index.
+
+        Arguments:
+            :sender: The address to look up (defaults to the hosting node).
+        """
+        if sender is None:
+            participant = self.hosting_node
+            if participant is None:
+                return None
+        else:
+            participant = sender
+        with balance_seconds.time():
+            self.refresh()
+            with self.__lock.read_lock():
+                return self.__balances.get_balance(participant)
+
+    def calculate_balance(self, participant):
+        """Calculate the balance for a participant by scanning the whole chain
+        (pruned blocks don't count, they have no transactions left).
+
+        Arguments:
+            :participant: The address to calculate the balance for.
+        """
+        with self.__lock.read_lock():
+            chain = FrozenView(self.__chain)
+            open_transactions = self.__mempool.transactions()
         # Nested list comprehension
         tx_sender = [[tx.amount for tx in block.transactions if tx.sender == participant]
-                     for block in self.__chain]
+                     for block in chain]
         open_tx_sender = [tx.amount
-                          for tx in self.__open_transactions if tx.sender == participant]
+                          for tx in open_transactions if tx.sender == participant]
         tx_sender.append(open_tx_sender)
         # Reducing list
         amount_sent = reduce(
             lambda tx_sum, tx_amt: tx_sum + sum(tx_amt) if len(tx_amt) > 0 else tx_sum + 0, tx_sender, 0)
         tx_recipient = [[tx.amount for tx in block.transactions if tx.recipient == participant]
-                        for block in self.__chain]
+                        for block in chain]
         # Reducing list
         amount_received = reduce(
             lambda tx_sum, tx_amt: tx_sum + sum(tx_amt) if len(tx_amt) > 0 else tx_sum + 0, tx_recipient, 0)
         return amount_received - amount_sent
 
+    def verify_balances(self):
+        """Check the balance index against a full chain scan and return the
+        addresses whose balances differ (pruned blocks can't be scanned, so
+        on a pruned chain the senders and recipients of their transactions do).
+
+        The scan computes what calculate_balance does for every address, in
+        one pass over the chain (which loads every lazy block once).
+        """
+        # Hold off writers, so the index and the scan see the same state
+        with self.__lock.read_lock():
+            received = {}
+            sent = {}
+            for block in self.__chain:
+                for tx in block.transactions:
+                    sent[tx.sender] = sent.get(tx.sender, 0) + tx.amount
+                    received[tx.recipient] = received.get(tx.recipient, 0) + tx.amount
+            # Open transactions only count for their senders
+            for tx in self.__mempool.transactions():
+                sent[tx.sender] = sent.get(tx.sender, 0) + tx.amount
+                received.setdefault(tx.recipient, 0)
+            return [participant for participant in received.keys() | sent.keys()
+                    if not math.isclose(self.__balances.get_balance(participant),
+                                        received.get(participant, 0) - sent.get(participant, 0),
+                                        abs_tol=1e-9)]
+
+    def find_transaction(self, transaction_id):
+        """Return a (transaction, block, position) tuple for a mined transaction,
+        a (transaction, None, None) tuple for an open one or None if it is unknown.
+        The transaction is None if its block was pruned.
+
+        Arguments:
+            :transaction_id: The id of the transaction.
+        """
+        self.refresh()
+        with self.__lock.read_lock():
+            location = self.__transaction_index.find(transaction_id)
+            if location is None:
+                transaction = self.__mempool.get(transaction_id)
+                return None if transaction is None else (transaction, None, None)
+            block = self.__chain[location[0]]
+        if block.pruned:
+            return None, block, location[1]
+        return block.transactions[location[1]], block, location[1]
+
+    def get_address_history(self, address, limit=None):
+        """Return the mined transactions of an address as (transaction, block,
+        position) tuples, newest first (transaction is None in pruned blocks).
+
+        Arguments:
+            :address: The address (public key) to look up.
+            :limit: The maximum number of transactions to return.
+        """
+        self.refresh()
+        with self.__lock.read_lock():
+            locations = self.__transaction_index.get_history(address, limit)
+            chain = FrozenView(self.__chain)
+        history = []
+        for height, position in locations:
+            block = chain[height]
+            transaction = None if block.pruned else block.transactions[position]
+            history.append((transaction, block, position))
+        return history
+
     def get_last_blockchain_value(self):
         """ Returns the last value of the current blockchain. """
+        chain = self.chain
         # if blockchain is empty
-        if len(self.__chain) < 1:
+        if len(chain) < 1:
             return None
-        return self.__chain[-1]
+        return chain[-1]
 
-    def add_transaction(self, recipient, sender, signature, amount=1.0):
+    def add_transaction(self, recipient, sender, signature, amount=1.0, nonce=None):
         """ Append a new value as well as the last blockchain value to the blockchain.
 
         Arguments:
             :sender: The sender of the coins.
             :recipient: The recipient of the coins.
             :amount: The amount of coins sent with the transaction (default = 1.0)
+            :nonce: The nonce the transaction was signed with.
         """
         # Unordered simple dictionary
         # transaction = {
@@ -145,38 +470,269 @@ class Blockchain:
         # }
         if self.hosting_node is None:
             return False
-        transaction = Transaction(sender, recipient, signature, amount)
-        if Verification.verify_transaction(transaction, self.get_balance):
-            self.__open_transactions.append(transaction)
-            self.save_data()
-            return True
-        return False
+        return self.add_transactions([Transaction(sender, recipient, signature, amount,
+                                                  nonce)])[0]
 
-    def mine_block(self):
-        """Create a new block and add open transactions to it."""
+    def add_transactions(self, transactions):
+        """Add several transactions at once and return whether each was accepted.
+
+        Every transaction is checked against the balance left by the ones
+        accepted before it, and the accepted ones are persisted with one write.
+        Transactions which are mined already are rejected, so they can't be
+        replayed.
+
+        Arguments:
+            :transactions: The transactions to add, in order.
+        """
+        # Check the signatures before locking, the checks below then hit the cache
+        signed = Wallet.verify_transactions(transactions)
+        results = []
+        accepted = []
+        removed = []
+        with self.__write_access():
+            try:
+                for transaction, valid in zip(transactions, signed):
+                    # Transactions with fields which can't be stored fail verification
+                    valid = (valid and
+                             self.__transaction_index.find(transaction.transaction_id) is None and
+                             Verification.verify_transaction(transaction,
+                                                             self.__balances.get_balance))
+                    if valid:
+                        valid, evicted = self.__mempool.add(transaction)
+                    if valid:
+                        # The balance index counts the accepted transactions as pending
+                        self.__balances.add_open_transaction(transaction)
+                        for tx in evicted:
+                            self.__balances.remove_open_transaction(tx)
+                        # Evicted transactions stay in the journal, loading it
+                        # evicts them again
+                        accepted.append(transaction)
+                        removed.extend(evicted)
+                    results.append(valid)
+            finally:
+                # Even if a transaction raised, the ones accepted before it are kept
+                if accepted:
+                    self.__generation += 1
+                    # Transactions accepted and evicted by the same call never show up
+                    accepted_ids = {tx.transaction_id for tx in accepted}
+                    removed_ids = {tx.transaction_id for tx in removed}
+                    self.events.publish('transactions', len(self.__chain), {
+                        'added': [tx for tx in accepted if tx.transaction_id not in removed_ids],
+                        'removed': [tx for tx in removed if tx.transaction_id not in accepted_ids]
+                    })
+                    try:
+                        self.storage.append_open_transactions(accepted)
+                    except IOError:
+                        print('Saving failed!')
+        return results
+
+    def get_block_template(self):
+        """Return what the next block has to be mined on top of, or None if no
+        block can be mined (no wallet or invalid open transactions)."""
         if self.hosting_node is None:
             return None
-        last_block = self.__chain[-1]
-        # List comprehension
-        hashed_block = hash_block(last_block)
-        proof = self.proof_of_work()
+        self.refresh()
+        with self.__lock.read_lock():
+            copied_transactions = self.__mempool.select(MAX_BLOCK_TRANSACTIONS)
+            if not all(Wallet.verify_transactions(copied_transactions, short_circuit=True)):
+                return None
+            # The reward goes to the hosting node, which can't change without
+            # changing the generation
+            transaction_ids = [tx.transaction_id for tx in copied_transactions]
+            transaction_ids.append(self.__reward_transaction().transaction_id)
+            return BlockTemplate(copied_transactions, self.__tip_hash,
+                                 self.get_next_difficulty(), self.__generation,
+                                 merkle_root(transaction_ids),
+                                 next_timestamp(self.__chain, len(self.__chain)),
+                                 len(self.__chain))
+
+    def __reward_transaction(self):
+        """Return the mining reward for the hosting node."""
         # Unordered simple dictionary
         # reward_transaction = {
         #     'sender': 'MINING',
         #     'recipient': OWNER,
         #     'amount': MINING_REWARD
         # }
-        reward_transaction = Transaction(
-            'MINING', self.hosting_node, '', MINING_REWARD)
-        # Use the range selector with only ':' to create a copy of a list
-        copied_transactions = self.__open_transactions[:]
-        for tx in copied_transactions:
-            if not Wallet.verify_transaction(tx):
+        return Transaction('MINING', self.hosting_node, '', MINING_REWARD)
+
+    def commit_block(self, template, proof):
+        """Create a block from a template and its proof and append it to the chain.
+
+        Returns the new block, or None if the chain or the open transactions
+        changed since the template was created.
+
+        Arguments:
+            :template: The BlockTemplate the proof was found for.
+            :proof: The proof of work for the template.
+        """
+        with self.__write_access():
+            if template.generation != self.__generation:
+                return None
+            block = Block(template.index, template.previous_hash,
+                          template.transactions + [self.__reward_transaction()], proof,
+                          template.timestamp, template.difficulty,
+                          merkle_root=template.merkle_root)
+            for tx in block.transactions:
+                tx.intern_addresses()
+            self.__chain.append(block)
+            self.__tip_hash = block.hash
+            for tx in self.__mempool.remove(template.transactions):
+                self.__balances.remove_open_transaction(tx)
+            self.__balances.add_block(block)
+            self.__transaction_index.add_block(block)
+            self.__generation += 1
+            self.events.publish('block', block.index + 1, block)
+            try:
+                self.storage.append_block(block)
+                self.storage.replace_open_transactions(self.__mempool.transactions(),
+                                                       len(self.__chain))
+            except IOError:
+                print('Saving failed!')
+            self.__after_blocks_added()
+            return block
+
+    def add_blocks(self, blocks, verify=True):
+        """Add blocks received from a peer, replacing our blocks from the index
+        of the first one on, if the new blocks hold more work than ours (see
+        utility.difficulty.chain_work), so the branch mined with the most
+        hashes wins rather than the one with the most blocks.
+
+        Transactions of replaced blocks which are not in the new blocks go back
+        to the open transactions, as long as their senders can still afford
+        them. Returns whether the blocks were added.
+
+        Arguments:
+            :blocks: Consecutive blocks, the first following a block of our chain.
+            :verify: Whether to verify the blocks (only skip it for blocks which
+                were verified on top of the same chain, as received from a peer).
+        """
+        blocks = list(blocks)
+        # Pruned blocks can't be verified
+        if not blocks or any(block.pruned for block in blocks):
+            return False
+        start = blocks[0].index
+        chain = self.chain
+        if start < 1 or start > len(chain) or chain_work(blocks) <= chain_work(chain[start:]):
+            return False
+        # Verify without holding the lock, a changed chain is caught below
+        if verify and not Verification.verify_chain(chain[:start] + blocks, start, start):
+            return False
+        with self.__write_access():
+            # The blocks before start are pinned by the hash the first block refers to
+            if (start > len(self.__chain) or
+                    chain_work(blocks) <= chain_work(self.__chain[start:]) or
+                    self.__chain[start - 1].hash != blocks[0].previous_hash):
+                return False
+            orphaned = self.__chain[start:]
+            if orphaned and orphaned[0].pruned:
+                print('Pruned blocks can\'t be replaced')
+                return False
+            confirmed = self.__balances.copy()
+            confirmed.clear_open_transactions()
+            for block in reversed(orphaned):
+                confirmed.remove_block(block)
+            if not self.__valid_transfers(blocks, confirmed, self.__transaction_index):
+                return False
+            for block in blocks:
+                for tx in block.transactions:
+                    tx.intern_addresses()
+            previous_transactions = self.__mempool.transactions()
+            pending = [tx for block in orphaned for tx in block.transactions[:-1]]
+            pending.extend(previous_transactions)
+            self.__transaction_index.truncate(self.__chain, start)
+            for block in blocks:
+                self.__transaction_index.add_block(block)
+            if orphaned:
+                # Readers keep their snapshot of the replaced chain
+                self.__chain = self.__chain[:start] + blocks
+            else:
+                self.__chain.extend(blocks)
+            self.__tip_hash = self.__chain[-1].hash
+            self.__balances = confirmed
+            mined = {tx.transaction_id for block in blocks for tx in block.transactions}
+            self.__mempool.replace([])
+            for tx in pending:
+                if tx.transaction_id in mined or confirmed.get_balance(tx.sender) < tx.amount:
+                    continue
+                accepted, evicted = self.__mempool.add(tx)
+                if accepted:
+                    confirmed.add_open_transaction(tx)
+                    for evicted_tx in evicted:
+                        confirmed.remove_open_transaction(evicted_tx)
+            self.__generation += 1
+            for block in blocks:
+                self.events.publish('block', block.index + 1, block)
+            self.__publish_transaction_changes(previous_transactions, blocks)
+            try:
+                if orphaned:
+                    self.storage.truncate(start)
+                    # The kept blocks still read from the replaced log
+                    self.__chain = self.storage.rebind(self.__chain)
+                for block in blocks:
+                    self.storage.append_block(block)
+                self.storage.replace_open_transactions(self.__mempool.transactions(),
+                                                       len(self.__chain))
+            except IOError:
+                print('Saving failed!')
+            if start < self.__snapshot_height:
+                # The snapshot covers replaced blocks
+                self.__save_snapshot()
+            else:
+                self.__after_blocks_added()
+            return True
+
+    @staticmethod
+    def __valid_transfers(blocks, balances, transaction_index):
+        """Check that blocks pay one mining reward each and only spend coins
+        their senders have, adding the blocks to the balance index.
+
+        Transfers which are mined before the first block (according to
+        transaction_index) or repeated within the blocks are replays."""
+        start = blocks[0].index
+        transferred = set()
+        for block in blocks:
+            transactions = block.transactions
+            if len(transactions) > MAX_BLOCK_TRANSACTIONS + 1:
+                print('Block holds too many transactions')
+                return False
+            if (not transactions or transactions[-1].sender != 'MINING' or
+                    transactions[-1].amount != MINING_REWARD or
+                    any(tx.sender == 'MINING' for tx in transactions[:-1])):
+                print('Mining reward is invalid')
+                return False
+            for tx in transactions[:-1]:
+                location = transaction_index.find(tx.transaction_id)
+                if (tx.transaction_id in transferred or
+                        location is not None and location[0] < start):
+                    print('Transaction is mined already')
+                    return False
+                transferred.add(tx.transaction_id)
+                if balances.get_balance(tx.sender) < tx.amount:
+                    print('Transaction exceeds the balance')
+                    return False
+                balances.add_open_transaction(tx)
+            balances.clear_open_transactions()
+            balances.add_block(block)
+        return True
+
+    def get_generation(self):
+        """Returns a number which changes whenever the chain or the open transactions do"""
+        return self.__generation
+
+    def mine_block(self):
+        """Create a new block and add open transactions to it."""
+        while True:
+            template = self.get_block_template()
+            if template is None:
                 return None
-        copied_transactions.append(reward_transaction)
-        block = Block(len(self.__chain), hashed_block,
-                      copied_transactions, proof)
-        self.__chain.append(block)
-        self.__open_transactions = []
-        self.save_data()
-        return block
+            # Mine again if something changed while searching the proof
+            proof = self.miner.find_proof(
+                template.proof_prefix, template.difficulty,
+                lambda: self.get_generation() != template.generation)
+            if proof is None:
+                continue
+            print(f'Found proof {proof} at {self.miner.hash_rate:.0f} hashes/s')
+            block = self.commit_block(template, proof)
+            if block is not None:
+                return block
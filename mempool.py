@@ -0,0 +1,141 @@
+import heapq
+from itertools import count
+
+# Orders in which transactions are picked for blocks
+ORDER_BY_AMOUNT = 'amount'
+ORDER_BY_ARRIVAL = 'arrival'
+
+
+class Mempool:
+    """Holds the open transactions, at most max_size of them.
+
+    Transactions are kept once per transaction id and ranked either by amount
+    (larger first, ties by arrival) or by arrival alone. When the pool is full
+    the lowest ranked transaction has to go, which may be the new one. The
+    ranking is a total order, so adding the same transactions again (e.g. when
+    replaying the journal) always leaves the same ones in the pool.
+
+    Attributes:
+        :max_size: the maximum number of transactions held.
+        :order: ORDER_BY_AMOUNT or ORDER_BY_ARRIVAL.
+    """
+
+    def __init__(self, max_size, order=ORDER_BY_AMOUNT):
+        if order not in (ORDER_BY_AMOUNT, ORDER_BY_ARRIVAL):
+            raise ValueError(f'Unknown mempool order: {order}')
+        self.max_size = max_size
+        self.order = order
+        # Transactions by id, in order of arrival, with their arrival numbers
+        self.__transactions = {}
+        self.__arrivals = count()
+        # Lowest ranked transaction first, removed transactions are skipped lazily
+        self.__eviction_heap = []
+        self.__snapshot = ()
+
+    def __len__(self):
+        return len(self.__transactions)
+
+    def __contains__(self, transaction_id):
+        return transaction_id in self.__transactions
+
+    def __rank(self, transaction, arrival):
+        """Return the sort key of a transaction, highest ranked first."""
+        if self.order == ORDER_BY_AMOUNT:
+            return (-transaction.amount, arrival)
+        return (arrival,)
+
+    def __eviction_key(self, transaction, arrival):
+        """Return the heap key of a transaction, lowest ranked first."""
+        if self.order == ORDER_BY_AMOUNT:
+            return (transaction.amount, -arrival)
+        return (-arrival,)
+
+    def get(self, transaction_id):
+        """Return the transaction with the given id (None if it isn't in the pool)."""
+        entry = self.__transactions.get(transaction_id)
+        return None if entry is None else entry[0]
+
+    def transactions(self):
+        """Return the transactions in order of arrival (an immutable snapshot)."""
+        if self.__snapshot is None:
+            self.__snapshot = tuple(transaction for transaction, _ in self.__transactions.values())
+        return self.__snapshot
+
+    def add(self, transaction):
+        """Add a transaction, returning whether it was accepted and the
+        transactions evicted to make room for it.
+
+        Arguments:
+            :transaction: The transaction to add.
+        """
+        transaction_id = transaction.transaction_id
+        if transaction_id in self.__transactions:
+            return False, []
+        arrival = next(self.__arrivals)
+        evicted = []
+        if len(self.__transactions) >= self.max_size:
+            lowest = self.__lowest()
+            if lowest is None or (self.__eviction_key(transaction, arrival) <
+                                  self.__eviction_key(*self.__transactions[lowest])):
+                return False, []
+            evicted.append(self.__transactions.pop(lowest)[0])
+            heapq.heappop(self.__eviction_heap)
+        self.__transactions[transaction_id] = (transaction, arrival)
+        heapq.heappush(self.__eviction_heap,
+                       (self.__eviction_key(transaction, arrival), transaction_id))
+        self.__snapshot = None
+        return True, evicted
+
+    def __lowest(self):
+        """Return the id of the lowest ranked transaction (None if empty)."""
+        heap = self.__eviction_heap
+        while heap:
+            key, transaction_id = heap[0]
+            entry = self.__transactions.get(transaction_id)
+            if entry is not None and self.__eviction_key(*entry) == key:
+                return transaction_id
+            heapq.heappop(heap)
+        return None
+
+    def select(self, limit):
+        """Return up to limit transactions, highest ranked first.
+
+        Arguments:
+            :limit: The maximum number of transactions to return.
+        """
+        ranked = heapq.nsmallest(limit, self.__transactions.values(),
+                                 key=lambda entry: self.__rank(*entry))
+        return [transaction for transaction, _ in ranked]
+
+    def remove(self, transactions):
+        """Remove transactions (e.g. because they got mined), returning the
+        ones which were in the pool.
+
+        Arguments:
+            :transactions: The transactions to remove.
+        """
+        removed = []
+        for transaction in transactions:
+            entry = self.__transactions.pop(transaction.transaction_id, None)
+            if entry is not None:
+                removed.append(entry[0])
+        if removed:
+            self.__snapshot = None
+            # Drop the stale heap entries once they outnumber the live ones
+            if len(self.__eviction_heap) > 2 * len(self.__transactions) + 64:
+                self.__eviction_heap = [(self.__eviction_key(*entry), transaction_id)
+                                        for transaction_id, entry in self.__transactions.items()]
+                heapq.heapify(self.__eviction_heap)
+        return removed
+
+    def replace(self, transactions):
+        """Replace the whole pool, adding the transactions in order.
+
+        Arguments:
+            :transactions: The new open transactions.
+        """
+        self.__transactions = {}
+        self.__eviction_heap = []
+        self.__snapshot = None
+        for transaction in transactions:
+            self.add(transaction)
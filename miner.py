@@ -0,0 +1,127 @@
+"""Proof of work search which can be spread across several processes."""
+
+import multiprocessing
+import queue
+from time import perf_counter
+
+from utility.difficulty import DEFAULT_DIFFICULTY
+from utility.metrics import registry
+from utility.proof_search import ProofSearch
+
+proof_seconds = registry.histogram('proof_of_work_seconds',
+                                   'Seconds spent searching a proof of work.')
+proof_hashes = registry.counter('proof_of_work_hashes_total',
+                                'Nonces tested while searching proofs of work.')
+# Seconds between two checks for cancellation while workers search in parallel
+CANCEL_CHECK_INTERVAL = 0.1
+
+
+def search_nonce_ranges(prefix, difficulty, worker, workers, chunk_size, found, results):
+    """Test the nonce ranges which belong to a worker until one of the
+    workers finds a valid proof.
+
+    The nonce space is cut into ranges of chunk_size nonces which are handed
+    out round-robin, so worker k tests ranges k, k + workers, k + 2 * workers...
+
+    Arguments:
+        :prefix: The proof prefix of the block for which the proof is created.
+        :difficulty: The number of leading zero bits the proof hash needs.
+        :worker: The number of this worker.
+        :workers: The total number of workers.
+        :chunk_size: The number of nonces in a range.
+        :found: Event which is set as soon as any worker found a proof.
+        :results: Queue receiving a (proof or None, tested nonces) tuple.
+    """
+    proof_search = ProofSearch(prefix, difficulty)
+    hashes = 0
+    start = worker * chunk_size
+    while not found.is_set():
+        proof = proof_search.search(start, start + chunk_size)
+        if proof is not None:
+            found.set()
+            results.put((proof, hashes + proof - start + 1))
+            return
+        hashes += chunk_size
+        start += workers * chunk_size
+    results.put((None, hashes))
+
+
+class Miner:
+    """Searches proofs of work using one or more processes, one search at a time.
+
+    Attributes:
+        :workers: the number of processes searching in parallel (1 searches inline).
+        :chunk_size: the number of nonces a worker tests before checking for cancellation.
+        :hashes: the number of nonces tested by the last (or running) search.
+        :elapsed: the duration of the last (or running) search in seconds.
+    """
+
+    def __init__(self, workers=1, chunk_size=1000):
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.hashes = 0
+        self.elapsed = 0.0
+
+    @property
+    def hash_rate(self):
+        """The hashes per second achieved by the last search."""
+        return self.hashes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def find_proof(self, prefix, difficulty=DEFAULT_DIFFICULTY, cancelled=None):
+        """Return a proof which gives the prefix followed by the proof a hash
+        with difficulty leading zero bits (for blocks with a Merkle root the
+        prefix is utility.hash_util.header_prefix), or None if the search was
+        cancelled.
+
+        Arguments:
+            :prefix: Everything the proof is hashed with, which comes before it.
+            :difficulty: The number of leading zero bits the proof hash needs.
+            :cancelled: A function checked between chunks of nonces (every
+                CANCEL_CHECK_INTERVAL seconds with several workers), the search
+                stops once it returns True.
+        """
+        started = perf_counter()
+        self.hashes = 0
+        self.elapsed = 0.0
+        if self.workers == 1:
+            proof_search = ProofSearch(prefix, difficulty)
+            start = 0
+            proof = None
+            while proof is None and not (cancelled is not None and cancelled()):
+                proof = proof_search.search(start, start + self.chunk_size)
+                start += self.chunk_size
+                self.hashes = start if proof is None else proof + 1
+                self.elapsed = perf_counter() - started
+        else:
+            proof = self.__find_proof_in_parallel(prefix, difficulty, cancelled)
+        self.elapsed = perf_counter() - started
+        proof_seconds.observe(self.elapsed)
+        proof_hashes.inc(self.hashes)
+        return proof
+
+    def __find_proof_in_parallel(self, prefix, difficulty, cancelled):
+        found = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(
+            target=search_nonce_ranges,
+            args=(prefix, difficulty, worker, self.workers, self.chunk_size, found, results),
+            daemon=True) for worker in range(self.workers)]
+        for process in processes:
+            process.start()
+        proofs = []
+        self.hashes = 0
+        # Every worker reports once, either its proof or that it was cancelled
+        for _ in processes:
+            while True:
+                try:
+                    proof, hashes = results.get(timeout=CANCEL_CHECK_INTERVAL)
+                    break
+                except queue.Empty:
+                    if cancelled is not None and cancelled():
+                        found.set()
+            self.hashes += hashes
+            if proof is not None:
+                proofs.append(proof)
+        for process in processes:
+            process.join()
+        return min(proofs) if proofs else None
@@ -0,0 +1,172 @@
+"""Mines blocks in a background thread so requests don't have to wait for it."""
+
+from collections import OrderedDict
+import threading
+from uuid import uuid4
+
+# Number of finished jobs whose status is kept
+JOB_HISTORY = 100
+
+
+class MiningService:
+    """Mines blocks on demand (one block per job) or continuously.
+
+    The proof is searched by the blockchain's Miner (with its workers), which
+    is cancelled as soon as the chain or the open transactions changed, and
+    the service starts over with a fresh block template.
+
+    Jobs only exist in the process which queued them. Several processes may
+    share the blockchain's storage (e.g. the workers of a WSGI server), but
+    the status of a job can only be polled from the process it was queued in,
+    so run a single process if clients follow their mining jobs.
+
+    Attributes:
+        :blockchain: the blockchain blocks are mined for.
+        :continuous: whether to keep mining blocks without jobs.
+        :on_block: a function called with every block mined (e.g. to broadcast it).
+    """
+
+    def __init__(self, blockchain, continuous=False, on_block=None):
+        self.blockchain = blockchain
+        self.continuous = continuous
+        self.on_block = on_block
+        self.__jobs = OrderedDict()
+        self.__queue = []
+        self.__condition = threading.Condition()
+        self.__thread = None
+        self.__running = False
+        self.__current_job = None
+        self.__restarts = 0
+        self.__difficulty = None
+
+    def start(self):
+        """Start the background thread (if it isn't running yet)."""
+        with self.__condition:
+            if self.__thread is not None:
+                return
+            self.__running = True
+            self.__thread = threading.Thread(target=self.__run, daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        """Stop the background thread, cancelling the current proof search."""
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+            thread = self.__thread
+            self.__thread = None
+        if thread is not None:
+            thread.join()
+
+    def request_block(self):
+        """Queue a job mining one block and return its id."""
+        job_id = uuid4().hex
+        with self.__condition:
+            self.__jobs[job_id] = {'job_id': job_id, 'status': 'pending', 'block': None,
+                                   'height': None}
+            self.__queue.append(job_id)
+            self.__condition.notify_all()
+        self.start()
+        return job_id
+
+    def get_status(self, job_id=None):
+        """Return the progress of the service and, if given, of a job (None if
+        the job is unknown)."""
+        with self.__condition:
+            status = {
+                'mining': self.__current_job is not None,
+                'continuous': self.continuous,
+                'pending_jobs': len(self.__queue),
+                'hashes': self.blockchain.miner.hashes,
+                'hash_rate': self.blockchain.miner.hash_rate,
+                'restarts': self.__restarts,
+                'difficulty': self.__difficulty
+            }
+            if job_id is not None:
+                if job_id not in self.__jobs:
+                    return None
+                status['job'] = dict(self.__jobs[job_id])
+            return status
+
+    def __run(self):
+        try:
+            self.__serve()
+        finally:
+            with self.__condition:
+                # Let start() run a new thread, also if this one died
+                if self.__thread is threading.current_thread():
+                    self.__thread = None
+                if self.__current_job and self.__jobs[self.__current_job]['status'] == 'mining':
+                    self.__jobs[self.__current_job]['status'] = 'failed'
+                self.__current_job = None
+
+    def __serve(self):
+        while True:
+            with self.__condition:
+                while self.__running and not self.__queue and not self.continuous:
+                    self.__condition.wait()
+                if not self.__running:
+                    return
+                self.__current_job = self.__queue.pop(0) if self.__queue else ''
+                if self.__current_job:
+                    self.__jobs[self.__current_job]['status'] = 'mining'
+            try:
+                block = self.__mine()
+                error = None
+            except Exception as exception:
+                print(f'Mining failed: {exception!r}')
+                block = None
+                error = exception
+            with self.__condition:
+                if self.__current_job:
+                    job = self.__jobs[self.__current_job]
+                    if block is not None:
+                        job['status'] = 'done'
+                        # The hash, as a reorganization may put another block at the height
+                        job['block'] = block.hash
+                        job['height'] = block.index
+                    elif self.__running or error is not None:
+                        job['status'] = 'failed'
+                    else:
+                        # Stopped before the block was mined, pick it up again on start
+                        job['status'] = 'pending'
+                        self.__queue.insert(0, self.__current_job)
+                self.__current_job = None
+                while len(self.__jobs) - len(self.__queue) > JOB_HISTORY:
+                    oldest = next(job_id for job_id, job in self.__jobs.items()
+                                  if job['status'] in ('done', 'failed'))
+                    del self.__jobs[oldest]
+                if block is None and (self.continuous or error is not None) and self.__running:
+                    # Nothing can be mined right now (e.g. no wallet or an error), don't spin
+                    self.__condition.wait(1)
+
+    def __mine(self):
+        """Search a proof for the current block template and commit the block.
+
+        Returns the block, or None if no block could be mined or the service
+        was stopped.
+        """
+        while self.__running:
+            template = self.blockchain.get_block_template()
+            if template is None:
+                return None
+            with self.__condition:
+                self.__difficulty = template.difficulty
+            proof = self.blockchain.miner.find_proof(
+                template.proof_prefix, template.difficulty,
+                lambda: (not self.__running or
+                         self.blockchain.get_generation() != template.generation))
+            if proof is not None:
+                block = self.blockchain.commit_block(template, proof)
+                if block is not None:
+                    if self.on_block is not None:
+                        try:
+                            self.on_block(block)
+                        except Exception as exception:
+                            # The block is mined anyway
+                            print(f'Handling the mined block failed: {exception!r}')
+                    return block
+            if self.__running:
+                with self.__condition:
+                    self.__restarts += 1
+        return None
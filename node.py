@@ -1,12 +1,113 @@
-from flask import Flask, jsonify, request, send_from_directory
+from argparse import ArgumentParser
+from functools import lru_cache
+import math
+from time import perf_counter
+
+from flask import Flask, Response, g, jsonify, request, send_from_directory
 from flask_cors import CORS
 from wallet import Wallet
-from blockchain import Blockchain
+from block import Block
+from transaction import Transaction, new_nonce
+from blockchain import Blockchain, LAZY_LOADING
+from mining_service import MiningService
+from peers import PeerNetwork, HEADER_BATCH
+from storage import BlockLogStorage
+from utility.difficulty import chain_work
+from utility.fields import NUMBER, field
+from utility.merkle import merkle_proof
+from utility.metrics import SamplingProfiler, registry
+
+# Number of serialized blocks kept in memory
+BLOCK_JSON_CACHE_SIZE = 10000
+# Number of transactions returned by /address/<key>/history by default
+HISTORY_LIMIT = 50
+# Seconds an event stream waits before checking for changes of other processes
+# (and sending a keep-alive comment)
+EVENTS_POLL_INTERVAL = 1
+DEFAULT_PORT = 5000
 
 app = Flask(__name__)
-wallet = Wallet()
-blockchain = Blockchain(wallet.public_key)
 CORS(app)
+request_seconds = registry.histogram('http_request_seconds',
+                                     'Seconds spent handling a request, by route.')
+requests_total = registry.counter('http_requests_total',
+                                  'Requests handled, by route, method and status.')
+# Samples the stacks of the node while switched on through /profiler
+profiler = SamplingProfiler()
+# Set up by init_node
+wallet_filename = None
+wallet = None
+blockchain = None
+miner_service = None
+peers = None
+
+
+def init_node(port=None):
+    """Set up the wallet, the blockchain, the miner and the peers of this node.
+
+    Arguments:
+        :port: The port the node listens on. If given, the node keeps its data
+            in files of its own, so several nodes can run side by side.
+    """
+    global wallet_filename, wallet, blockchain, miner_service, peers
+    suffix = '' if port is None else f'-{port}'
+    wallet_filename = f'wallet{suffix}.txt'
+    wallet = Wallet(wallet_filename)
+    storage = BlockLogStorage(f'blockchain{suffix}.log', f'blockchain{suffix}.idx',
+                              f'open_transactions{suffix}.log', f'blockchain{suffix}.txt',
+                              lazy=LAZY_LOADING)
+    # Shared, so several worker processes of a WSGI server can serve the same chain.
+    # Mining jobs aren't shared though (see MiningService), /mine/status only
+    # knows the jobs of the process answering it
+    blockchain = Blockchain(wallet.public_key, storage, shared=True)
+    peers = PeerNetwork(blockchain, f'localhost:{port or DEFAULT_PORT}', f'peers{suffix}.txt')
+    miner_service = MiningService(blockchain, on_block=peers.broadcast_block)
+
+
+@app.before_request
+def start_timer():
+    g.started = perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_seconds.observe(perf_counter() - g.started, route=route, method=request.method)
+    requests_total.inc(route=route, method=request.method, status=str(response.status_code))
+    return response
+
+
+@lru_cache(maxsize=BLOCK_JSON_CACHE_SIZE)
+def block_json(block):
+    """Return the JSON bytes of a block (blocks are immutable, so this is cached)."""
+    return app.json.dumps(block.to_dict()).encode()
+
+
+def pruned_height(chain):
+    """Return the number of pruned blocks, which are always the first ones of a chain."""
+    low, high = 0, len(chain)
+    while low < high:
+        middle = (low + high) // 2
+        if chain[middle].pruned:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def cached_json_response(etag, make_body):
+    """Return a JSON response tagged with etag, or 304 if the client has it already.
+
+    Arguments:
+        :etag: The entity tag of the response.
+        :make_body: A function returning the JSON bytes, only called if needed.
+    """
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(make_body(), mimetype='application/json')
+    response.set_etag(etag)
+    return response
 
 
 @app.route('/', methods=['GET'])
@@ -16,13 +117,16 @@ def get_ui():
 
 @app.route('/wallet', methods=['POST'])
 def create_keys():
-    wallet.create_keys()
-    if wallet.save_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key)
+    new_wallet = Wallet(wallet_filename)
+    new_wallet.create_keys()
+    if new_wallet.save_keys():
+        # Swap in the whole wallet, so requests never see half of its keys
+        global wallet
+        wallet = new_wallet
+        blockchain.set_hosting_node(new_wallet.public_key)
         response = {
-            'public_key': wallet.public_key,
-            'private_key': wallet.private_key,
+            'public_key': new_wallet.public_key,
+            'private_key': new_wallet.private_key,
             'funds': blockchain.get_balance()
         }
         return jsonify(response), 201
@@ -35,12 +139,15 @@ def create_keys():
 
 @app.route('/wallet', methods=['GET'])
 def load_keys():
-    if wallet.load_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key)
+    new_wallet = Wallet(wallet_filename)
+    if new_wallet.load_keys():
+        # Swap in the whole wallet, so requests never see half of its keys
+        global wallet
+        wallet = new_wallet
+        blockchain.set_hosting_node(new_wallet.public_key)
         response = {
-            'public_key': wallet.public_key,
-            'private_key': wallet.private_key,
+            'public_key': new_wallet.public_key,
+            'private_key': new_wallet.private_key,
             'funds': blockchain.get_balance()
         }
         return jsonify(response), 201
@@ -70,7 +177,9 @@ def get_balance():
 
 @app.route('/transaction', methods=['POST'])
 def add_transaction():
-    if wallet.private_key is None:
+    # The wallet may be swapped by another request, stick to one
+    current_wallet = wallet
+    if current_wallet.private_key is None:
         response = {
             'message': 'No wallet set up.'
         }
@@ -81,29 +190,37 @@ def add_transaction():
             'message': 'No data found.'
         }
         return jsonify(response), 400
-    required_fields = ['recipient', 'amount']
-    if not all(field in values for field in required_fields):
+    try:
+        recipient = field(values, 'recipient', str)
+        amount = field(values, 'amount', NUMBER)
+    except KeyError:
         response = {
             'message': 'Required data is missing.'
         }
         return jsonify(response), 400
-    recipient = values['recipient']
-    amount = values['amount']
-    signature = wallet.sign_transaction(wallet.public_key, recipient, amount)
-    success = blockchain.add_transaction(
-        recipient, wallet.public_key, signature, amount)
+    except TypeError:
+        response = {
+            'message': 'Required data is invalid.'
+        }
+        return jsonify(response), 400
+    nonce = new_nonce()
+    signature = current_wallet.sign_transaction(current_wallet.public_key, recipient, amount,
+                                                nonce)
+    transaction = Transaction(current_wallet.public_key, recipient, signature, amount, nonce)
+    success = blockchain.add_transactions([transaction])[0]
     if success:
+        peers.broadcast_transactions([transaction])
         response = {
             'message': 'Successfully added transaction.',
-            'transaction': {
-                'sender': wallet.public_key,
-                'recipient': recipient,
-                'amount': amount,
-                'signature': signature
-            },
+            'transaction': transaction.to_dict(),
             'funds': blockchain.get_balance()
         }
         return jsonify(response), 201
+    elif blockchain.find_transaction(transaction.transaction_id) is not None:
+        response = {
+            'message': 'Transaction is a duplicate.'
+        }
+        return jsonify(response), 409
     else:
         response = {
             'message': 'Creating a transaction failed.'
@@ -111,43 +228,450 @@ def add_transaction():
         return jsonify(response), 500
 
 
+@app.route('/transactions/batch', methods=['POST'])
+def add_transactions():
+    current_wallet = wallet
+    if current_wallet.private_key is None:
+        response = {
+            'message': 'No wallet set up.'
+        }
+        return jsonify(response), 400
+    values = request.get_json()
+    if not isinstance(values, dict) or not isinstance(values.get('transactions'), list):
+        response = {
+            'message': 'No transactions found.'
+        }
+        return jsonify(response), 400
+    items = values['transactions']
+    complete = []
+    payments = []
+    for index, item in enumerate(items):
+        try:
+            payment = (field(item, 'recipient', str), field(item, 'amount', NUMBER), new_nonce())
+        except (KeyError, TypeError):
+            continue
+        complete.append(index)
+        payments.append(payment)
+    signatures = current_wallet.sign_transactions(current_wallet.public_key, payments)
+    transactions = [Transaction(current_wallet.public_key, recipient, signature, amount, nonce)
+                    for (recipient, amount, nonce), signature in zip(payments, signatures)]
+    added = dict(zip(complete, zip(transactions, blockchain.add_transactions(transactions))))
+    peers.broadcast_transactions([transaction for transaction, accepted in added.values()
+                                  if accepted])
+    results = []
+    for index in range(len(items)):
+        if index not in added:
+            results.append({'accepted': False, 'message': 'Required data is missing or invalid.'})
+        elif added[index][1]:
+            results.append({'accepted': True, 'transaction': added[index][0].to_dict()})
+        elif blockchain.find_transaction(added[index][0].transaction_id) is not None:
+            results.append({'accepted': False, 'message': 'Transaction is a duplicate.'})
+        else:
+            results.append({'accepted': False, 'message': 'Creating a transaction failed.'})
+    response = {
+        'message': 'Processed transactions.',
+        'results': results,
+        'funds': blockchain.get_balance()
+    }
+    return jsonify(response), 200
+
+
 @app.route('/mine', methods=['POST'])
 def mine():
-    block = blockchain.mine_block()
-    if block is not None:
-        dict_block = block.__dict__.copy()
-        dict_block['transactions'] = [
-            tx.__dict__ for tx in dict_block['transactions']]
-        response = {
-            'message': 'Block added successfully.',
-            'block': dict_block,
-            'funds': blockchain.get_balance()
-        }
-        return jsonify(response), 201
-    else:
+    if blockchain.hosting_node is None:
         response = {
             'message': 'Adding a block failed.',
             'wallet_set_up': wallet.public_key is not None
         }
         return jsonify(response), 500
+    job_id = miner_service.request_block()
+    response = {
+        'message': 'Mining started.',
+        'job_id': job_id
+    }
+    return jsonify(response), 202
+
+
+@app.route('/mine/status', methods=['GET'])
+def get_mining_status():
+    status = miner_service.get_status(request.args.get('job'))
+    if status is None:
+        response = {
+            'message': 'Mining job not found (jobs are only known to the process '
+                       'which started them).'
+        }
+        return jsonify(response), 404
+    job = status.get('job')
+    if job is not None and job['status'] == 'done':
+        chain_snapshot = blockchain.chain
+        height = job['height']
+        if height < len(chain_snapshot) and chain_snapshot[height].hash == job['block']:
+            status['message'] = 'Block added successfully.'
+            status['block'] = chain_snapshot[height].to_dict()
+        else:
+            status['message'] = 'Block was mined, but replaced by a peer\'s chain.'
+            status['block'] = None
+        status['funds'] = blockchain.get_balance()
+    elif job is not None and job['status'] == 'failed':
+        status['message'] = 'Adding a block failed.'
+    return jsonify(status), 200
 
 
 @app.route('/transactions', methods=['GET'])
 def get_open_transactions():
     transactions = blockchain.get_open_transactions()
-    dict_transactions = [tx.__dict__ for tx in transactions]
+    dict_transactions = [tx.to_dict() for tx in transactions]
     return jsonify(dict_transactions), 200
 
 
 @app.route('/chain', methods=['GET'])
 def get_chain():
+    start = request.args.get('from', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    if start < 0 or (limit is not None and limit < 0):
+        response = {
+            'message': 'Invalid block range.'
+        }
+        return jsonify(response), 400
+    chain_snapshot = blockchain.chain
+    # The tip hash changes whenever the chain does and the pruned height
+    # whenever blocks lose their transactions, so they identify the content
+    etag = f'{chain_snapshot[-1].hash}-{pruned_height(chain_snapshot)}-{start}-{limit}'
+
+    def make_body():
+        stop = len(chain_snapshot) if limit is None else start + limit
+        return b'[' + b','.join(block_json(block) for block in chain_snapshot[start:stop]) + b']'
+    return cached_json_response(etag, make_body)
+
+
+@app.route('/block/<int:index>', methods=['GET'])
+def get_block(index):
+    chain_snapshot = blockchain.chain
+    if index >= len(chain_snapshot):
+        response = {
+            'message': 'Block not found.'
+        }
+        return jsonify(response), 404
+    block = chain_snapshot[index]
+    # A pruned block has the same hash, but not the same content
+    etag = f'{block.hash}-pruned' if block.pruned else block.hash
+    return cached_json_response(etag, lambda: block_json(block))
+
+
+def server_sent_event(kind, event_id, data):
+    """Format an event of a text/event-stream response (data is JSON bytes)."""
+    return b'event: %s\nid: %d\ndata: %s\n\n' % (kind.encode(), event_id, data)
+
+
+def transactions_json(transactions):
+    return app.json.dumps([tx.to_dict() for tx in transactions]).encode()
+
+
+def stream_events(height):
+    """Yield the blocks from height on and the open transactions, then the
+    changes as they are published.
+
+    Event ids are chain heights, so a client resumes with the last id it got.
+    """
+    while True:
+        sequence = blockchain.events.sequence
+        chain_snapshot = blockchain.chain
+        for block in chain_snapshot[height:]:
+            yield server_sent_event('block', block.index + 1, block_json(block))
+        height = len(chain_snapshot)
+        yield server_sent_event('mempool', height,
+                                transactions_json(blockchain.get_open_transactions()))
+        while True:
+            events = blockchain.events.wait(sequence, EVENTS_POLL_INTERVAL)
+            if events is None:
+                # Fell behind the history of the event bus, catch up from height
+                break
+            if not events:
+                # Picks up (and publishes) the changes of other processes
+                blockchain.refresh()
+                yield b': keep-alive\n\n'
+                continue
+            for event in events:
+                sequence = event.sequence
+                if event.kind == 'block':
+                    height = event.height
+                    yield server_sent_event('block', height, block_json(event.data))
+                elif event.kind == 'transactions':
+                    yield server_sent_event('transactions', height, b'{"added":%s,"removed":%s}' % (
+                        transactions_json(event.data['added']),
+                        transactions_json(event.data['removed'])))
+                else:
+                    height = event.height
+                    yield server_sent_event(event.kind, height, b'null')
+
+
+@app.route('/events', methods=['GET'])
+def get_events():
+    # Browsers reconnect with the id of the last event they got
+    start = request.headers.get('Last-Event-ID', type=int)
+    if start is None:
+        start = request.args.get('from', type=int)
+    if start is None:
+        start = len(blockchain.chain)
+    if start < 0:
+        response = {
+            'message': 'Invalid block height.'
+        }
+        return jsonify(response), 400
+    return Response(stream_events(start), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/tx/<transaction_id>', methods=['GET'])
+def get_transaction(transaction_id):
+    found = blockchain.find_transaction(transaction_id)
+    if found is None:
+        response = {
+            'message': 'Transaction not found.'
+        }
+        return jsonify(response), 404
+    transaction, block, position = found
+    response = {
+        'transaction': None if transaction is None else transaction.to_dict(),
+        'transaction_id': transaction_id if transaction is None else transaction.transaction_id,
+        'block': None if block is None else block.index,
+        'position': position,
+        'pending': block is None,
+        'pruned': block is not None and block.pruned
+    }
+    return jsonify(response), 200
+
+
+@app.route('/tx/<transaction_id>/proof', methods=['GET'])
+def get_transaction_proof(transaction_id):
+    found = blockchain.find_transaction(transaction_id)
+    if found is None or found[1] is None:
+        response = {
+            'message': 'Transaction not found in a block.'
+        }
+        return jsonify(response), 404
+    transaction, block, position = found
+    if block.merkle_root is None or block.pruned:
+        response = {
+            'message': 'No proof for blocks without a Merkle root or transactions.'
+        }
+        return jsonify(response), 404
+    # Verified with utility.merkle.verify_merkle_proof against the header's
+    # Merkle root, the header's hash links it to the chain of headers
+    response = {
+        'transaction_id': transaction.transaction_id,
+        'block': block.index,
+        'position': position,
+        'merkle_root': block.merkle_root,
+        'proof': merkle_proof([tx.transaction_id for tx in block.transactions], position),
+        'header': dict(block.to_header_dict(), hash=block.hash)
+    }
+    return jsonify(response), 200
+
+
+@app.route('/address/<address>/history', methods=['GET'])
+def get_address_history(address):
+    limit = request.args.get('limit', HISTORY_LIMIT, type=int)
+    if limit < 0:
+        response = {
+            'message': 'Invalid limit.'
+        }
+        return jsonify(response), 400
+    history = [{
+        'transaction': None if transaction is None else transaction.to_dict(),
+        'transaction_id': None if transaction is None else transaction.transaction_id,
+        'block': block.index,
+        'position': position,
+        'pruned': block.pruned
+    } for transaction, block, position in blockchain.get_address_history(address, limit)]
+    response = {
+        'address': address,
+        'history': history
+    }
+    return jsonify(response), 200
+
+
+@app.route('/headers', methods=['GET'])
+def get_headers():
+    start = request.args.get('from', 0, type=int)
+    limit = request.args.get('limit', HEADER_BATCH, type=int)
+    if start < 0 or limit < 0:
+        response = {
+            'message': 'Invalid block range.'
+        }
+        return jsonify(response), 400
+    chain_snapshot = blockchain.chain
+    headers = [dict(block.to_header_dict(), hash=block.hash)
+               for block in chain_snapshot[start:start + min(limit, HEADER_BATCH)]]
+    response = {
+        'height': len(chain_snapshot),
+        'work': chain_work(chain_snapshot),
+        'headers': headers
+    }
+    return jsonify(response), 200
+
+
+@app.route('/broadcast-transactions', methods=['POST'])
+def broadcast_transactions():
+    values = request.get_json()
+    if not isinstance(values, dict) or not isinstance(values.get('transactions'), list):
+        response = {
+            'message': 'No transactions found.'
+        }
+        return jsonify(response), 400
+    # Items with missing or invalid data are rejected, the others still count
+    accepted = []
+    transactions = []
+    for item in values['transactions']:
+        try:
+            transactions.append(Transaction.from_dict(item))
+            accepted.append(None)
+        except (KeyError, TypeError):
+            accepted.append(False)
+    added = iter(blockchain.add_transactions(transactions))
+    response = {
+        'message': 'Processed transactions.',
+        'accepted': [next(added) if result is None else result for result in accepted]
+    }
+    return jsonify(response), 200
+
+
+@app.route('/broadcast-block', methods=['POST'])
+def broadcast_block():
+    values = request.get_json()
+    if not values or 'block' not in values:
+        response = {
+            'message': 'No block found.'
+        }
+        return jsonify(response), 400
+    try:
+        block = Block.from_dict(values['block'])
+    except (KeyError, TypeError, ValueError):
+        response = {
+            'message': 'Required data is missing or invalid.'
+        }
+        return jsonify(response), 400
     chain_snapshot = blockchain.chain
-    dict_chain = [block.__dict__.copy() for block in chain_snapshot]
-    for dict_block in dict_chain:
-        dict_block['transactions'] = [
-            tx.__dict__ for tx in dict_block['transactions']]
-    return jsonify(dict_chain), 200
+    # A block may also replace our tip, if it holds more work
+    if block.index <= len(chain_snapshot) and blockchain.add_blocks([block]):
+        response = {
+            'message': 'Block added.'
+        }
+        return jsonify(response), 201
+    known = (block.index < len(chain_snapshot) and
+             chain_snapshot[block.index].hash == block.hash)
+    # We're missing blocks or are on another branch, catch up with the sender
+    # (which only switches over if its branch holds more work) if we know it
+    if not known and isinstance(values.get('peer'), str) and peers.request_sync(values['peer']):
+        response = {
+            'message': 'Syncing with the peer.'
+        }
+        return jsonify(response), 202
+    response = {
+        'message': 'Block rejected.'
+    }
+    return jsonify(response), 409
+
+
+@app.route('/sync', methods=['POST'])
+def sync():
+    added = peers.sync()
+    response = {
+        'message': 'Synced with the peers.',
+        'blocks_added': added,
+        'height': len(blockchain.chain)
+    }
+    return jsonify(response), 200
+
+
+@app.route('/peers', methods=['POST'])
+def add_peer():
+    values = request.get_json()
+    if not values or 'node' not in values:
+        response = {
+            'message': 'No node found.'
+        }
+        return jsonify(response), 400
+    peers.add_peer(values['node'])
+    response = {
+        'message': 'Peer added successfully.',
+        'peers': peers.get_peers()
+    }
+    return jsonify(response), 201
+
+
+@app.route('/peers/<path:peer>', methods=['DELETE'])
+def remove_peer(peer):
+    peers.remove_peer(peer)
+    response = {
+        'message': 'Peer removed.',
+        'peers': peers.get_peers()
+    }
+    return jsonify(response), 200
+
+
+@app.route('/peers', methods=['GET'])
+def get_peers():
+    response = {
+        'peers': peers.get_peers()
+    }
+    return jsonify(response), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/profiler', methods=['POST'])
+def toggle_profiler():
+    values = request.get_json()
+    if not isinstance(values, dict) or 'enabled' not in values:
+        response = {
+            'message': 'No data found.'
+        }
+        return jsonify(response), 400
+    try:
+        interval = field(values, 'interval', NUMBER, optional=True)
+        # The sampling thread would spin without a positive interval
+        valid = interval is None or 0 < interval < math.inf
+    except TypeError:
+        valid = False
+    if not valid:
+        response = {
+            'message': 'The interval has to be a positive number of seconds.'
+        }
+        return jsonify(response), 400
+    if values['enabled']:
+        if interval is not None:
+            profiler.interval = float(interval)
+        profiler.start()
+    else:
+        profiler.stop()
+    response = {
+        'message': 'Profiler started.' if profiler.running else 'Profiler stopped.',
+        'running': profiler.running,
+        'interval': profiler.interval
+    }
+    return jsonify(response), 200
+
+
+@app.route('/profiler', methods=['GET'])
+def get_profile():
+    samples, stacks = profiler.report()
+    # Collapsed stacks, as read by flame graph tools
+    return Response(stacks, mimetype='text/plain', headers={'X-Profile-Samples': str(samples)})
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--port', type=int, default=None,
+                        help=f'port to listen on (default {DEFAULT_PORT}), '
+                             'nodes started with a port keep their data in files of their own')
+    args = parser.parse_args()
+    init_node(args.port)
+    app.run(host='0.0.0.0', port=args.port or DEFAULT_PORT)
+else:
+    # Imported by a WSGI server, serve the default files (with several worker
+    # processes, mining jobs can only be polled from the worker which started them)
+    init_node()
@@ -1,5 +1,6 @@
 from uuid import uuid4
 from blockchain import Blockchain
+from transaction import new_nonce
 from utility.verification import Verification
 from wallet import Wallet
 
@@ -35,7 +36,9 @@ class Node:
 
     def listen_for_input(self):
         """Main entry of the program"""
-        waiting_for_input = True
+        waiting_for_input = self.blockchain.verify_chain(full=True)
+        if not waiting_for_input:
+            print('Invalid blockchain')
         while waiting_for_input:
             print('Please choose')
             print('1: Add a new transaction value')
@@ -51,8 +54,9 @@ class Node:
                 tx_data = self.get_transaction_value()
                 # Pulls out data from tuple and store in variables
                 recipient, amount = tx_data
-                signature = self.wallet.sign_transaction(self.wallet.public_key, recipient, amount)
-                if self.blockchain.add_transaction(recipient, self.wallet.public_key, signature, amount=amount):
+                nonce = new_nonce()
+                signature = self.wallet.sign_transaction(self.wallet.public_key, recipient, amount, nonce)
+                if self.blockchain.add_transaction(recipient, self.wallet.public_key, signature, amount=amount, nonce=nonce):
                     print('Added transaction!')
                 else:
                     print('Transaction failed.')
@@ -80,7 +84,7 @@ class Node:
                 waiting_for_input = False
             else:
                 print('Input was invalid, please pick a value from the list')
-            if not Verification.verify_chain(self.blockchain.chain):
+            if not self.blockchain.verify_chain():
                 self.print_blockchain_elements()
                 print('Invalid blockchain')
                 break
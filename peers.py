@@ -0,0 +1,235 @@
+"""Keeps track of the peer nodes and exchanges transactions and blocks with them."""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from block import Block
+from utility.difficulty import chain_work
+from utility.verification import Verification
+
+# Seconds to wait for a peer to answer
+PEER_TIMEOUT = 5
+# Number of threads sending broadcasts, so requests don't wait for the peers
+BROADCAST_WORKERS = 4
+# Maximum number of headers and of blocks requested at once while syncing
+HEADER_BATCH = 2000
+BLOCK_BATCH = 500
+
+
+class PeerNetwork:
+    """Manages the peers of a node, broadcasts new transactions and blocks to
+    them and catches up with peers whose chain holds more work.
+
+    Syncing is header-first: the block headers are compared from the tip
+    downwards to find the last block both chains share, then only the blocks
+    after it are fetched, in batches which are verified as they arrive.
+
+    Attributes:
+        :blockchain: the blockchain of this node.
+        :address: the host:port of this node, sent along with broadcast blocks.
+        :filename: the file the peers are saved to (None to not save them).
+    """
+
+    def __init__(self, blockchain, address=None, filename=None):
+        self.blockchain = blockchain
+        self.address = address
+        self.filename = filename
+        self.__peers = set()
+        # Peers which are being synced with, at most one sync per peer at a time
+        self.__syncing = set()
+        self.__lock = threading.Lock()
+        self.__executor = None
+        self.load_peers()
+
+    @staticmethod
+    def normalize(peer):
+        """Return the host:port of a peer given with or without a URL scheme."""
+        peer = peer.strip()
+        for scheme in ('http://', 'https://'):
+            if peer.startswith(scheme):
+                peer = peer[len(scheme):]
+        return peer.rstrip('/')
+
+    def load_peers(self):
+        """Load the peers saved before."""
+        if self.filename is None:
+            return
+        try:
+            with open(self.filename, mode='r', encoding='utf-8') as file:
+                peers = {line.strip() for line in file if line.strip()}
+            with self.__lock:
+                self.__peers = peers
+        except IOError:
+            pass
+
+    def save_peers(self):
+        """Save the peers, so they are known again after a restart."""
+        if self.filename is None:
+            return
+        try:
+            with open(self.filename, mode='w', encoding='utf-8') as file:
+                file.write(''.join(f'{peer}\n' for peer in self.get_peers()))
+        except IOError:
+            print('Saving peers failed!')
+
+    def add_peer(self, peer):
+        """Add a peer (host:port).
+
+        Arguments:
+            :peer: The peer to add.
+        """
+        with self.__lock:
+            self.__peers.add(self.normalize(peer))
+        self.save_peers()
+
+    def remove_peer(self, peer):
+        """Remove a peer (host:port).
+
+        Arguments:
+            :peer: The peer to remove.
+        """
+        with self.__lock:
+            self.__peers.discard(self.normalize(peer))
+        self.save_peers()
+
+    def get_peers(self):
+        """Return the peers, sorted."""
+        with self.__lock:
+            return sorted(self.__peers)
+
+    @staticmethod
+    def request(peer, path, payload=None):
+        """Send a request to a peer and return its decoded JSON answer.
+
+        Arguments:
+            :peer: The host:port of the peer.
+            :path: The path (and query) of the request.
+            :payload: Data to POST as JSON (None for a GET request).
+        """
+        data = None if payload is None else json.dumps(payload).encode()
+        request = Request(f'http://{peer}{path}', data=data,
+                          headers={'Content-Type': 'application/json'})
+        with urlopen(request, timeout=PEER_TIMEOUT) as response:
+            return json.loads(response.read())
+
+    def __send(self, peer, path, payload):
+        try:
+            self.request(peer, path, payload)
+        except (URLError, OSError, ValueError):
+            print(f'Broadcasting to {peer} failed!')
+
+    def __broadcast(self, path, payload):
+        """Send a payload to every peer in the background."""
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(BROADCAST_WORKERS)
+            executor = self.__executor
+        for peer in self.get_peers():
+            executor.submit(self.__send, peer, path, payload)
+
+    def broadcast_transactions(self, transactions):
+        """Send transactions which were added to the open transactions to the peers."""
+        if transactions:
+            self.__broadcast('/broadcast-transactions',
+                             {'transactions': [tx.to_dict() for tx in transactions]})
+
+    def broadcast_block(self, block):
+        """Send a block which was mined here to the peers."""
+        self.__broadcast('/broadcast-block', {'block': block.to_dict(), 'peer': self.address})
+
+    def sync(self):
+        """Catch up with every peer whose chain holds more work, returning the
+        number of blocks added."""
+        return sum(self.sync_with(peer) for peer in self.get_peers())
+
+    def sync_with(self, peer):
+        """Catch up with a peer if its chain holds more work, returning the
+        number of blocks added (0 if a sync with it is running already).
+
+        Arguments:
+            :peer: The host:port of the peer.
+        """
+        peer = self.normalize(peer)
+        with self.__lock:
+            if peer in self.__syncing:
+                return 0
+            self.__syncing.add(peer)
+        return self.__run_sync(peer)
+
+    def request_sync(self, peer):
+        """Catch up with a known peer in a background thread, unless a sync
+        with it is running already. Returns whether a sync was started.
+
+        Arguments:
+            :peer: The host:port of the peer.
+        """
+        peer = self.normalize(peer)
+        with self.__lock:
+            if peer not in self.__peers or peer in self.__syncing:
+                return False
+            self.__syncing.add(peer)
+        threading.Thread(target=self.__run_sync, args=(peer,), daemon=True).start()
+        return True
+
+    def __run_sync(self, peer):
+        """Sync with a peer which was added to the syncing peers, removing it
+        from them when done."""
+        try:
+            return self.__sync_with(peer)
+        except (URLError, OSError, ValueError, KeyError, TypeError):
+            print(f'Syncing with {peer} failed!')
+            return 0
+        finally:
+            with self.__lock:
+                self.__syncing.discard(peer)
+
+    def __sync_with(self, peer):
+        summary = self.request(peer, '/headers?limit=0')
+        height = summary['height']
+        chain = self.blockchain.chain
+        if summary['work'] <= chain_work(chain):
+            return 0
+        common = self.__find_common_block(peer, chain, min(height, len(chain)) - 1)
+        if common is None:
+            print(f'{peer} has a different genesis block')
+            return 0
+        candidate = chain[:common + 1]
+        # Index of the first block which isn't part of our chain yet
+        start = common + 1
+        added = 0
+        while len(candidate) < height:
+            blocks = [Block.from_dict(block) for block in self.request(
+                peer, f'/chain?from={len(candidate)}&limit={BLOCK_BATCH}')]
+            if not blocks:
+                break
+            first = len(candidate)
+            candidate.extend(blocks)
+            if not Verification.verify_chain(candidate, first, start):
+                print(f'{peer} sent invalid blocks')
+                break
+            # Switch over as soon as the peer's branch holds more work than ours
+            if chain_work(candidate[start:]) > chain_work(self.blockchain.chain[start:]):
+                if not self.blockchain.add_blocks(candidate[start:], verify=False):
+                    break
+                added += len(candidate) - start
+                start = len(candidate)
+        return added
+
+    def __find_common_block(self, peer, chain, top):
+        """Return the index of the last block a peer shares with chain (None if
+        there is none), comparing headers from top downwards."""
+        batch = 1
+        while top >= 0:
+            low = max(0, top - batch + 1)
+            headers = self.request(peer, f'/headers?from={low}&limit={top - low + 1}')['headers']
+            for header in reversed(headers):
+                index = header['index']
+                if low <= index <= top and chain[index].hash == header['hash']:
+                    return index
+            top = low - 1
+            # Usually the tip matches, only request more headers if it doesn't
+            batch = min(batch * 2, HEADER_BATCH)
+        return None
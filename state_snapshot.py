@@ -0,0 +1,90 @@
+"""Snapshots of the chain state, so a node doesn't replay the whole chain on startup.
+
+A snapshot is one record: a JSON header with the height, the tip hash and the
+confirmed balances, and a binary body with the transaction index (empty if it
+isn't included). Body layout (big-endian): the number of transaction ids
+followed by (id, packed location) pairs, the number of addresses followed by
+each address, the number of its locations and the locations.
+"""
+
+from array import array
+import json
+import struct
+import sys
+
+from balance_index import BalanceIndex
+from transaction_index import TransactionIndex
+from utility.codec import COUNT, encode_string, decode_string
+
+LOCATION = struct.Struct('>32sQ')
+
+
+class StateSnapshot:
+    """The state of the chain up to a height.
+
+    Attributes:
+        :height: the number of blocks the state covers.
+        :tip_hash: the hash of the last of these blocks.
+        :balances: the BalanceIndex of the blocks (without open transactions).
+        :transaction_index: the TransactionIndex of the blocks (or None).
+    """
+
+    def __init__(self, height, tip_hash, balances, transaction_index=None):
+        self.height = height
+        self.tip_hash = tip_hash
+        self.balances = balances
+        self.transaction_index = transaction_index
+
+    def encode(self):
+        """Return the (header, body) bytes of the snapshot record."""
+        header = json.dumps({
+            'height': self.height,
+            'tip_hash': self.tip_hash,
+            'received': self.balances.received,
+            'sent': self.balances.sent,
+            'transaction_index': self.transaction_index is not None
+        }).encode()
+        if self.transaction_index is None:
+            return header, b''
+        locations = self.transaction_index.locations
+        parts = [COUNT.pack(len(locations))]
+        parts.extend(LOCATION.pack(transaction_id, location)
+                     for transaction_id, location in locations.items())
+        parts.append(COUNT.pack(len(self.transaction_index.history)))
+        for address, address_locations in self.transaction_index.history.items():
+            if sys.byteorder == 'little':
+                address_locations = array('Q', address_locations)
+                address_locations.byteswap()
+            parts.append(encode_string(address))
+            parts.append(COUNT.pack(len(address_locations)))
+            parts.append(address_locations.tobytes())
+        return header, b''.join(parts)
+
+    @classmethod
+    def decode(cls, header, body):
+        """Create a snapshot from the (header, body) bytes of its record."""
+        header = json.loads(header)
+        balances = BalanceIndex()
+        balances.received = header['received']
+        balances.sent = header['sent']
+        transaction_index = None
+        if header['transaction_index']:
+            transaction_index = TransactionIndex()
+            count = COUNT.unpack_from(body, 0)[0]
+            position = COUNT.size
+            transaction_index.locations = dict(LOCATION.iter_unpack(
+                body[position:position + count * LOCATION.size]))
+            position += count * LOCATION.size
+            count = COUNT.unpack_from(body, position)[0]
+            position += COUNT.size
+            for _ in range(count):
+                address, position = decode_string(body, position)
+                length = COUNT.unpack_from(body, position)[0]
+                position += COUNT.size
+                locations = array('Q', body[position:position + length * 8])
+                if sys.byteorder == 'little':
+                    locations.byteswap()
+                transaction_index.history[address] = locations
+                position += length * 8
+            transaction_index.height = header['height']
+        return cls(header['height'], header['tip_hash'], balances, transaction_index)
@@ -0,0 +1,705 @@
+"""Storage backends which persist the blockchain and its open transactions."""
+
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from functools import partial
+import json
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    # No locking between processes where fcntl isn't available (Windows)
+    fcntl = None
+
+from block import Block
+from state_snapshot import StateSnapshot
+from transaction import Transaction
+from utility.codec import encode_transactions, decode_transactions
+
+# Every record starts with: header length, body length, CRC32 of header + body
+RECORD_HEADER = struct.Struct('>III')
+# Every index entry is the offset of a block record inside the block log
+INDEX_ENTRY = struct.Struct('>Q')
+# Bytes copied at once when the log is truncated
+COPY_CHUNK_SIZE = 1 << 20
+# Number of decoded block bodies kept for lazy blocks (the most recently read)
+BODY_CACHE_SIZE = 256
+
+
+class Storage:
+    """Interface of a blockchain storage backend."""
+
+    def load(self):
+        """Return a (blocks, open transactions) tuple with the persisted data."""
+        raise NotImplementedError
+
+    def save(self, chain, open_transactions):
+        """Replace everything which is persisted with the given data."""
+        raise NotImplementedError
+
+    def append_block(self, block):
+        """Persist a block which was appended to the chain."""
+        raise NotImplementedError
+
+    def truncate(self, height):
+        """Drop the persisted blocks from height on (e.g. for a reorganization)."""
+        raise NotImplementedError
+
+    def append_open_transactions(self, transactions):
+        """Persist transactions which were added to the open transactions."""
+        raise NotImplementedError
+
+    def replace_open_transactions(self, transactions, height):
+        """Persist the open transactions left after the chain reached height."""
+        raise NotImplementedError
+
+    def read_block(self, index):
+        """Return the persisted block with the given index."""
+        raise NotImplementedError
+
+    def load_snapshot(self):
+        """Return the persisted StateSnapshot (None if there is none)."""
+        return None
+
+    def save_snapshot(self, snapshot):
+        """Persist a StateSnapshot, returning whether the backend keeps snapshots."""
+        return False
+
+    def prune(self, chain, height):
+        """Drop the transactions of the persisted blocks below height, keeping
+        their headers and hashes."""
+        raise NotImplementedError
+
+    def rebind(self, chain):
+        """Return chain with the blocks which load their transactions from the
+        backend reading them from its current files (after save, truncate or
+        prune replaced them)."""
+        return chain
+
+    def sync(self):
+        """Make sure everything written so far reached the disk."""
+
+    def close(self):
+        """Release all resources held by the backend."""
+
+    def process_lock(self):
+        """Return a context manager keeping other processes from writing."""
+        return nullcontext()
+
+    def has_changed(self):
+        """Check whether another process changed the persisted data."""
+        return False
+
+    def refresh(self, chain):
+        """Pick up changes made by other processes.
+
+        Returns None if nothing changed, otherwise a (blocks, open transactions,
+        reloaded) tuple, where blocks are either the blocks appended to chain
+        or, if reloaded is set, the whole chain.
+        """
+        return None
+
+
+class SnapshotStorage(Storage):
+    """Stores the chain and the open transactions as one JSON snapshot file,
+    which is rewritten completely on every change.
+
+    Attributes:
+        :filename: the snapshot file.
+    """
+
+    def __init__(self, filename='blockchain.txt'):
+        self.filename = filename
+        self.__chain = []
+        self.__open_transactions = []
+
+    def load(self):
+        try:
+            with open(self.filename, mode='r', encoding='utf-8') as file:
+                file_content = file.readlines()
+                # Read the blockchain line without the '\n' special character
+                self.__chain = [Block.from_dict(block)
+                                for block in json.loads(file_content[0][:-1])]
+                self.__open_transactions = [Transaction.from_dict(tx)
+                                            for tx in json.loads(file_content[1])]
+        except (IOError, IndexError):
+            pass
+        return self.__chain[:], self.__open_transactions[:]
+
+    def save(self, chain, open_transactions):
+        self.__chain = list(chain)
+        self.__open_transactions = list(open_transactions)
+        try:
+            with open(self.filename, mode='w', encoding='utf-8') as file:
+                file.write(json.dumps([block.to_dict() for block in self.__chain]))
+                file.write('\n')
+                file.write(json.dumps([tx.to_dict() for tx in self.__open_transactions]))
+        except IOError:
+            print('Saving failed!')
+
+    def append_block(self, block):
+        self.save(self.__chain + [block], self.__open_transactions)
+
+    def truncate(self, height):
+        self.save(self.__chain[:height], self.__open_transactions)
+
+    def append_open_transactions(self, transactions):
+        self.save(self.__chain, self.__open_transactions + list(transactions))
+
+    def replace_open_transactions(self, transactions, height):
+        self.save(self.__chain, transactions)
+
+    def read_block(self, index):
+        return self.__chain[index]
+
+
+class BlockLogStorage(Storage):
+    """Stores blocks in an append-only log of length-prefixed records, with a
+    separate journal for the open transactions.
+
+    A block record holds a JSON header (everything but the transactions) and a
+    binary body (the transactions, see utility.codec), so headers can be read without parsing
+    bodies. The offset of every block record is kept in an index file, which
+    makes reading a single block a seek instead of a scan. The first journal
+    record stores the chain height the open transactions belong to.
+
+    In lazy mode only the block headers are read by load, the transactions of
+    a block are read from the log whenever they are accessed. A lazy block
+    reads from the record it was loaded from: replacing the log (by save,
+    truncate or prune) leaves the old log open for the blocks which still
+    refer to it, until rebind moves them over to the new one. The bodies read
+    last from the current log are cached, so the blocks which are asked for
+    again and again (usually the latest ones) aren't decoded every time,
+    while memory stays bounded however much of the chain is read.
+
+    Pruned blocks are stored as header records which carry the block hash and
+    have no transactions. The latest StateSnapshot is kept in a file of its own.
+
+    Several processes can share the files: writers hold process_lock (a lock
+    file) and everyone calls refresh to pick up the changes of the others.
+
+    Attributes:
+        :log_filename: the append-only block log.
+        :index_filename: the block offset index.
+        :journal_filename: the open transactions journal.
+        :legacy_filename: a snapshot file which gets imported into an empty log.
+        :sync_every: the number of writes after which the files get fsync'ed.
+        :lazy: whether blocks are loaded without their transactions.
+        :snapshot_filename: the state snapshot (by default the log's name
+            with a .snapshot extension).
+        :body_cache_size: the number of decoded block bodies cached in lazy mode.
+    """
+
+    def __init__(self, log_filename='blockchain.log', index_filename='blockchain.idx',
+                 journal_filename='open_transactions.log',
+                 legacy_filename='blockchain.txt', sync_every=16, lazy=False,
+                 snapshot_filename=None, body_cache_size=BODY_CACHE_SIZE):
+        self.log_filename = log_filename
+        self.index_filename = index_filename
+        self.journal_filename = journal_filename
+        if snapshot_filename is None:
+            snapshot_filename = os.path.splitext(log_filename)[0] + '.snapshot'
+        self.snapshot_filename = snapshot_filename
+        self.legacy_filename = legacy_filename
+        self.sync_every = sync_every
+        self.lazy = lazy
+        self.body_cache_size = body_cache_size
+        # Lazy blocks read from the log at any time, so file access is serialized
+        self.__lock = threading.RLock()
+        self.__offsets = []
+        # Decoded transactions of records in the current log by offset
+        self.__bodies = OrderedDict()
+        self.__log = None
+        self.__index = None
+        self.__journal = None
+        self.__unsynced = 0
+        # The process the files were opened in (forked children reopen them)
+        self.__pid = None
+        self.__lock_file = None
+        self.__lock_pid = None
+        # File sizes and inodes as of the last time we read or wrote them
+        self.__seen = None
+
+    @staticmethod
+    def encode_record(header, body):
+        """Frame a header and a body (both bytes) as one log record."""
+        return RECORD_HEADER.pack(len(header), len(body),
+                                  zlib.crc32(header + body)) + header + body
+
+    @staticmethod
+    def read_record(file):
+        """Read the record at the current position of a file.
+
+        Returns a (header, body) tuple of bytes or None if the record is
+        missing, incomplete or corrupted.
+        """
+        prefix = file.read(RECORD_HEADER.size)
+        if len(prefix) < RECORD_HEADER.size:
+            return None
+        header_length, body_length, checksum = RECORD_HEADER.unpack(prefix)
+        payload = file.read(header_length + body_length)
+        if len(payload) < header_length + body_length or zlib.crc32(payload) != checksum:
+            return None
+        return payload[:header_length], payload[header_length:]
+
+    @classmethod
+    def read_record_at(cls, file, offset):
+        """Read the record at offset in a file, like read_record, but without
+        moving the file position (which is shared with forked processes)
+        where the platform allows."""
+        if not hasattr(os, 'pread'):
+            file.seek(offset)
+            return cls.read_record(file)
+        prefix = os.pread(file.fileno(), RECORD_HEADER.size, offset)
+        if len(prefix) < RECORD_HEADER.size:
+            return None
+        header_length, body_length, checksum = RECORD_HEADER.unpack(prefix)
+        payload = os.pread(file.fileno(), header_length + body_length,
+                           offset + RECORD_HEADER.size)
+        if len(payload) < header_length + body_length or zlib.crc32(payload) != checksum:
+            return None
+        return payload[:header_length], payload[header_length:]
+
+    @staticmethod
+    def encode_block(block):
+        """Return the (header, body) bytes of a block record."""
+        return (json.dumps(block.to_header_dict()).encode(),
+                encode_transactions(block.transactions))
+
+    @staticmethod
+    def block_from_header(header, transactions=None, load_transactions=None):
+        """Create a block from a decoded header and its transactions (or a
+        function loading them), ignoring both if the block is pruned."""
+        if header.get('pruned'):
+            return Block(header['index'], header['previous_hash'], None, header['proof'],
+                         header['timestamp'], header.get('difficulty'),
+                         block_hash=header['hash'], merkle_root=header.get('merkle_root'))
+        return Block(header['index'], header['previous_hash'], transactions,
+                     header['proof'], header['timestamp'], header.get('difficulty'),
+                     load_transactions, merkle_root=header.get('merkle_root'))
+
+    @classmethod
+    def decode_block(cls, header, body):
+        """Create a block from the (header, body) bytes of a block record."""
+        return cls.block_from_header(json.loads(header), cls.decode_transactions(body))
+
+    @staticmethod
+    def decode_transactions(body):
+        """Create the (mined, so interned) transactions from the body bytes of
+        a block record, which are binary encoded or a JSON list (as written by
+        older versions)."""
+        if body[:1] == b'[':
+            transactions = [Transaction.from_dict(tx) for tx in json.loads(body)]
+        else:
+            transactions = decode_transactions(body)
+        return [tx.intern_addresses() for tx in transactions]
+
+    def __open(self):
+        """Open the files, repairing torn writes left behind by a crash."""
+        if self.__log is not None and self.__pid == os.getpid():
+            return
+        # File positions are shared with the parent after a fork, so reopen
+        # (lazy blocks keep reading the log they were loaded from by offset)
+        for file in (self.__index, self.__journal) if self.lazy else \
+                (self.__log, self.__index, self.__journal):
+            if file is not None:
+                file.close()
+        self.__journal = None
+        self.__pid = os.getpid()
+        self.__bodies.clear()
+        self.__log = open(self.log_filename, mode='a+b')
+        self.__index = open(self.index_filename, mode='a+b')
+        self.__recover()
+
+    def __signature(self):
+        """Return the inodes and sizes of the log and the journal."""
+        signature = []
+        for filename in (self.log_filename, self.journal_filename):
+            try:
+                stat = os.stat(filename)
+                signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    @contextmanager
+    def process_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with self.__lock:
+            if self.__lock_file is None or self.__lock_pid != os.getpid():
+                # Locks are shared with the parent after a fork, so reopen
+                self.__lock_file = open(self.log_filename + '.lock', mode='a+b')
+                self.__lock_pid = os.getpid()
+            fcntl.flock(self.__lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.__lock_file.fileno(), fcntl.LOCK_UN)
+
+    def has_changed(self):
+        return self.__seen is not None and self.__signature() != self.__seen
+
+    def refresh(self, chain):
+        with self.__lock:
+            self.__open()
+            if not self.has_changed():
+                return None
+            if os.stat(self.log_filename).st_ino != os.fstat(self.__log.fileno()).st_ino:
+                # The log was rewritten by save, start over
+                if not self.lazy:
+                    # Otherwise lazy blocks still read from it
+                    self.__log.close()
+                self.__log = None
+                chain, open_transactions = self.load()
+                return chain, open_transactions, True
+            if self.__journal is not None and (
+                    not os.path.exists(self.journal_filename) or
+                    os.stat(self.journal_filename).st_ino != os.fstat(self.__journal.fileno()).st_ino):
+                # The journal was replaced, appends have to go to the new one
+                self.__journal.close()
+                self.__journal = None
+            self.__index.seek(len(self.__offsets) * INDEX_ENTRY.size)
+            raw_index = self.__index.read()
+            blocks = []
+            for position in range(0, len(raw_index) - len(raw_index) % INDEX_ENTRY.size,
+                                  INDEX_ENTRY.size):
+                offset = INDEX_ENTRY.unpack_from(raw_index, position)[0]
+                self.__log.seek(offset)
+                # Another process may still be writing it
+                if self.read_record(self.__log) is None:
+                    break
+                self.__offsets.append(offset)
+                blocks.append(self.read_block(len(self.__offsets) - 1))
+            open_transactions = self.__load_journal(list(chain) + blocks)
+            self.__seen = self.__signature()
+            return blocks, open_transactions, False
+
+    def __recover(self):
+        """Bring the log and the index back to a consistent state.
+
+        Index entries pointing at missing or corrupted records are dropped,
+        records which are missing in the index are added to it and whatever
+        can't be read at the end of the log (a torn tail) is truncated.
+        """
+        self.__index.seek(0)
+        raw_index = self.__index.read()
+        offsets = [INDEX_ENTRY.unpack_from(raw_index, position)[0] for position in
+                   range(0, len(raw_index) - len(raw_index) % INDEX_ENTRY.size, INDEX_ENTRY.size)]
+        log_size = os.fstat(self.__log.fileno()).st_size
+        # Only the last records can be affected by a crash, so find the last
+        # indexed record which is intact and scan the log from there on
+        while offsets:
+            self.__log.seek(offsets[-1])
+            if offsets[-1] < log_size and self.read_record(self.__log) is not None:
+                break
+            offsets.pop()
+        position = 0
+        if offsets:
+            self.__log.seek(offsets[-1])
+            self.read_record(self.__log)
+            position = self.__log.tell()
+        self.__log.seek(position)
+        while self.read_record(self.__log) is not None:
+            offsets.append(position)
+            position = self.__log.tell()
+        if position < log_size:
+            self.__log.truncate(position)
+        if len(offsets) * INDEX_ENTRY.size != len(raw_index) or offsets != [
+                INDEX_ENTRY.unpack_from(raw_index, i * INDEX_ENTRY.size)[0] for i in range(len(offsets))]:
+            self.__index.truncate(0)
+            self.__index.write(b''.join(INDEX_ENTRY.pack(offset) for offset in offsets))
+            self.__index.flush()
+        self.__offsets = offsets
+
+    def __write(self, file, data):
+        """Append data to a file, fsync'ing every sync_every writes."""
+        file.seek(0, os.SEEK_END)
+        file.write(data)
+        file.flush()
+        self.__unsynced += 1
+        if self.__unsynced >= self.sync_every:
+            self.sync()
+
+    def __load_journal(self, chain):
+        """Read the open transactions journal.
+
+        Transactions which already made it into a block (because the journal
+        wasn't rewritten before a crash) are filtered out.
+        """
+        transactions = []
+        try:
+            with open(self.journal_filename, mode='rb') as file:
+                record = self.read_record(file)
+                if record is None:
+                    return transactions
+                height = json.loads(record[0])['height']
+                while True:
+                    record = self.read_record(file)
+                    if record is None:
+                        break
+                    if record[1][:1] == b'{':
+                        transactions.append(Transaction.from_dict(json.loads(record[1])))
+                    else:
+                        transactions.extend(decode_transactions(record[1]))
+        except IOError:
+            return transactions
+        if height < len(chain):
+            mined = {tx.transaction_id for block in chain[height:] for tx in block.transactions}
+            transactions = [tx for tx in transactions if tx.transaction_id not in mined]
+        return transactions
+
+    def __recover_journal(self):
+        """Truncate the journal after its last intact record, so appends don't
+        end up behind a torn write (where reading it stops).
+
+        Returns the size of the intact part, 0 if not even the height record is.
+        """
+        with open(self.journal_filename, mode='r+b') as file:
+            position = 0
+            while self.read_record(file) is not None:
+                position = file.tell()
+            if position < os.fstat(file.fileno()).st_size:
+                file.truncate(position)
+                file.flush()
+                os.fsync(file.fileno())
+        return position
+
+    def __import_legacy(self):
+        """Copy the content of a legacy snapshot file into the empty log."""
+        if self.legacy_filename is None or not os.path.exists(self.legacy_filename):
+            return
+        chain, open_transactions = SnapshotStorage(self.legacy_filename).load()
+        if chain:
+            self.save(chain, open_transactions)
+
+    def load(self):
+        with self.__lock:
+            self.__open()
+            if not self.__offsets:
+                self.__import_legacy()
+            if self.lazy:
+                chain = self.__read_headers()
+            else:
+                chain = [self.read_block(index) for index in range(len(self.__offsets))]
+            open_transactions = self.__load_journal(chain)
+            self.__seen = self.__signature()
+            return chain, open_transactions
+
+    def __read_headers(self):
+        """Create lazy blocks from the headers of all block records."""
+        chain = []
+        for offset in self.__offsets:
+            self.__log.seek(offset)
+            header_length = RECORD_HEADER.unpack(self.__log.read(RECORD_HEADER.size))[0]
+            header = json.loads(self.__log.read(header_length))
+            chain.append(self.block_from_header(
+                header, load_transactions=partial(self.read_transactions, self.__log, offset)))
+        return chain
+
+    def rebind(self, chain):
+        with self.__lock:
+            if not self.lazy:
+                return chain
+            self.__open()
+            return [Block(block.index, block.previous_hash, None, block.proof, block.timestamp,
+                          block.difficulty,
+                          partial(self.read_transactions, self.__log, self.__offsets[block.index]),
+                          block.hash, block.merkle_root)
+                    if block.lazy and block.index < len(self.__offsets) else block
+                    for block in chain]
+
+    def save(self, chain, open_transactions):
+        with self.__lock:
+            self.__open()
+            # The new log is written next to the current one, which lazy blocks
+            # may still be read from, and then swapped in
+            offsets = []
+            with open(self.log_filename + '.tmp', mode='wb') as log, \
+                    open(self.index_filename + '.tmp', mode='wb') as index:
+                for block in chain:
+                    offsets.append(log.tell())
+                    log.write(self.encode_record(*self.encode_block(block)))
+                    index.write(INDEX_ENTRY.pack(offsets[-1]))
+                for file in (log, index):
+                    file.flush()
+                    os.fsync(file.fileno())
+            self.__swap_in(offsets)
+            self.replace_open_transactions(open_transactions, len(chain))
+            self.__seen = self.__signature()
+
+    def __swap_in(self, offsets):
+        """Replace the log and the index with the .tmp files written next to them."""
+        if not self.lazy:
+            # Otherwise lazy blocks still read from it, it is closed once they're gone
+            self.__log.close()
+        self.__index.close()
+        # Without an index the log gets scanned on the next start, so a
+        # crash in between can't pair the new log with the old index
+        os.remove(self.index_filename)
+        os.replace(self.log_filename + '.tmp', self.log_filename)
+        os.replace(self.index_filename + '.tmp', self.index_filename)
+        self.__bodies.clear()
+        self.__log = open(self.log_filename, mode='a+b')
+        self.__index = open(self.index_filename, mode='a+b')
+        self.__offsets = offsets
+
+    def __copy_log(self, file, start, end=None):
+        """Copy the log from offset start to offset end (or its end) into file."""
+        self.__log.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            data = self.__log.read(COPY_CHUNK_SIZE if remaining is None
+                                   else min(remaining, COPY_CHUNK_SIZE))
+            if not data:
+                break
+            file.write(data)
+            if remaining is not None:
+                remaining -= len(data)
+
+    def truncate(self, height):
+        with self.__lock:
+            self.__open()
+            if height >= len(self.__offsets):
+                return
+            self.sync()
+            # The kept records are copied as they are into a new log which is
+            # swapped in, so other processes notice the change and reload
+            with open(self.log_filename + '.tmp', mode='wb') as log, \
+                    open(self.index_filename + '.tmp', mode='wb') as index:
+                self.__copy_log(log, 0, self.__offsets[height])
+                index.write(b''.join(INDEX_ENTRY.pack(offset)
+                                     for offset in self.__offsets[:height]))
+                for file in (log, index):
+                    file.flush()
+                    os.fsync(file.fileno())
+            self.__swap_in(self.__offsets[:height])
+            self.__seen = self.__signature()
+
+    def prune(self, chain, height):
+        with self.__lock:
+            self.__open()
+            height = min(height, len(self.__offsets), len(chain))
+            self.sync()
+            # Hash the blocks before the log they may be read from is replaced
+            headers = [self.encode_block(block.without_transactions())
+                       for block in chain[:height]]
+            offsets = []
+            with open(self.log_filename + '.tmp', mode='wb') as log, \
+                    open(self.index_filename + '.tmp', mode='wb') as index:
+                for header, body in headers:
+                    offsets.append(log.tell())
+                    log.write(self.encode_record(header, body))
+                # The records above height are copied as they are
+                if height < len(self.__offsets):
+                    shift = log.tell() - self.__offsets[height]
+                    self.__copy_log(log, self.__offsets[height])
+                    offsets.extend(offset + shift for offset in self.__offsets[height:])
+                index.write(b''.join(INDEX_ENTRY.pack(offset) for offset in offsets))
+                for file in (log, index):
+                    file.flush()
+                    os.fsync(file.fileno())
+            self.__swap_in(offsets)
+            self.__seen = self.__signature()
+
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_filename, mode='rb') as file:
+                record = self.read_record(file)
+        except FileNotFoundError:
+            return None
+        return None if record is None else StateSnapshot.decode(*record)
+
+    def save_snapshot(self, snapshot):
+        temporary_filename = self.snapshot_filename + '.tmp'
+        with open(temporary_filename, mode='wb') as file:
+            file.write(self.encode_record(*snapshot.encode()))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_filename, self.snapshot_filename)
+        return True
+
+    def append_block(self, block):
+        with self.__lock:
+            self.__open()
+            offset = os.fstat(self.__log.fileno()).st_size
+            self.__write(self.__log, self.encode_record(*self.encode_block(block)))
+            self.__write(self.__index, INDEX_ENTRY.pack(offset))
+            self.__offsets.append(offset)
+            self.__seen = self.__signature()
+
+    def append_open_transactions(self, transactions):
+        with self.__lock:
+            self.__open()
+            if self.__journal is None:
+                if not os.path.exists(self.journal_filename) or not self.__recover_journal():
+                    # Without its height record the journal can't be read at all
+                    self.replace_open_transactions([], len(self.__offsets))
+                self.__journal = open(self.journal_filename, mode='ab')
+            self.__write(self.__journal, b''.join(
+                self.encode_record(b'', encode_transactions([tx])) for tx in transactions))
+            self.__seen = self.__signature()
+
+    def replace_open_transactions(self, transactions, height):
+        with self.__lock:
+            self.__open()
+            # The blocks have to be on disk before the journal forgets the
+            # transactions they contain
+            self.sync()
+            if self.__journal is not None:
+                self.__journal.close()
+                self.__journal = None
+            temporary_filename = self.journal_filename + '.tmp'
+            with open(temporary_filename, mode='wb') as file:
+                file.write(self.encode_record(json.dumps({'height': height}).encode(), b''))
+                for tx in transactions:
+                    file.write(self.encode_record(b'', encode_transactions([tx])))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_filename, self.journal_filename)
+            self.__seen = self.__signature()
+
+    def read_block(self, index):
+        with self.__lock:
+            self.__open()
+            self.__log.seek(self.__offsets[index])
+            return self.decode_block(*self.read_record(self.__log))
+
+    def read_transactions(self, log, offset):
+        """Return the transactions of the block record at offset in log (the
+        current log or one it replaced)."""
+        with self.__lock:
+            current = log is self.__log
+            if current and offset in self.__bodies:
+                self.__bodies.move_to_end(offset)
+                return self.__bodies[offset]
+            record = self.read_record_at(log, offset)
+            if record is None:
+                raise ValueError('Block record is missing or corrupted')
+            transactions = tuple(self.decode_transactions(record[1]))
+            if current and self.body_cache_size > 0:
+                self.__bodies[offset] = transactions
+                while len(self.__bodies) > self.body_cache_size:
+                    self.__bodies.popitem(last=False)
+            return transactions
+
+    def sync(self):
+        with self.__lock:
+            for file in (self.__log, self.__index, self.__journal):
+                if file is not None:
+                    file.flush()
+                    os.fsync(file.fileno())
+            self.__unsynced = 0
+
+    def close(self):
+        with self.__lock:
+            self.sync()
+            for file in (self.__log, self.__index, self.__journal):
+                if file is not None:
+                    file.close()
+            self.__log = self.__index = self.__journal = None
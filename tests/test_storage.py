@@ -0,0 +1,100 @@
+"""Crash recovery of the block log and the open transactions journal.
+
+Run from the project root with: python -m unittest
+"""
+
+import os
+import tempfile
+import unittest
+
+from block import Block
+from storage import BlockLogStorage
+from transaction import Transaction
+
+
+class BlockLogRecoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, filename):
+        return os.path.join(self.directory.name, filename)
+
+    def open_storage(self):
+        storage = BlockLogStorage(self.path('blockchain.log'), self.path('blockchain.idx'),
+                                  self.path('open_transactions.log'), legacy_filename=None)
+        self.addCleanup(storage.close)
+        return storage
+
+    @staticmethod
+    def block(index):
+        return Block(index, f'hash-{index}', [Transaction('MINING', 'miner', '', 10)],
+                     index, timestamp=index)
+
+    @staticmethod
+    def transaction(amount):
+        return Transaction('sender', 'recipient', f'signature-{amount}', amount)
+
+    def append_garbage(self, filename):
+        """Leave a torn write behind, as a crash in the middle of an append would."""
+        with open(self.path(filename), mode='ab') as file:
+            file.write(b'\x00\x00\x00\x10\x00\x00\x01\x00torn')
+
+    def test_torn_log_tail_is_truncated(self):
+        storage = self.open_storage()
+        for index in range(3):
+            storage.append_block(self.block(index))
+        storage.close()
+        self.append_garbage('blockchain.log')
+
+        storage = self.open_storage()
+        chain, _ = storage.load()
+        self.assertEqual([block.index for block in chain], [0, 1, 2])
+        storage.append_block(self.block(3))
+        storage.close()
+
+        chain, _ = self.open_storage().load()
+        self.assertEqual([block.index for block in chain], [0, 1, 2, 3])
+        self.assertEqual(chain[3].hash, self.block(3).hash)
+
+    def test_missing_index_entries_are_rebuilt(self):
+        storage = self.open_storage()
+        for index in range(3):
+            storage.append_block(self.block(index))
+        storage.close()
+        with open(self.path('blockchain.idx'), mode='r+b') as file:
+            file.truncate(12)
+
+        chain, _ = self.open_storage().load()
+        self.assertEqual([block.index for block in chain], [0, 1, 2])
+
+    def test_torn_journal_tail_is_truncated(self):
+        storage = self.open_storage()
+        storage.append_block(self.block(0))
+        storage.append_open_transactions([self.transaction(1), self.transaction(2)])
+        storage.close()
+        self.append_garbage('open_transactions.log')
+
+        storage = self.open_storage()
+        _, open_transactions = storage.load()
+        self.assertEqual([tx.amount for tx in open_transactions], [1, 2])
+        storage.append_open_transactions([self.transaction(3)])
+        storage.close()
+
+        _, open_transactions = self.open_storage().load()
+        self.assertEqual([tx.amount for tx in open_transactions], [1, 2, 3])
+
+    def test_journal_without_height_record_is_replaced(self):
+        self.append_garbage('open_transactions.log')
+
+        storage = self.open_storage()
+        storage.append_open_transactions([self.transaction(1)])
+        storage.close()
+
+        _, open_transactions = self.open_storage().load()
+        self.assertEqual([tx.amount for tx in open_transactions], [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,95 @@
 from collections import OrderedDict
+import json
+import secrets
+
 from utility.printable import Printable
+from utility.hash_util import hash_string_256
+from utility.address_table import addresses
+from utility.fields import NUMBER, field
+
+# Random bytes of a nonce, which keeps repeated payments apart
+NONCE_BYTES = 8
+
+
+def new_nonce():
+    """Return a random nonce for a new transaction."""
+    return secrets.token_hex(NONCE_BYTES)
 
 
 class Transaction(Printable):
-    """A transaction which can be added to a block in the blockchain."""
+    """A transaction which can be added to a block in the blockchain.
+
+    Transactions are immutable. Once mined, their sender and recipient are
+    shared with the other transactions of these addresses (see
+    intern_addresses), so every public key is only stored once.
+
+    The nonce is signed along with the payment, so paying the same amount to
+    the same recipient twice gives two transactions with different ids.
+    Transactions created before nonces were introduced have none.
+    """
+    __slots__ = ('sender', 'recipient', 'amount', 'signature', 'nonce', '__transaction_id')
+
+    def __init__(self, sender, recipient, signature, amount, nonce=None):
+        object.__setattr__(self, 'sender', sender)
+        object.__setattr__(self, 'recipient', recipient)
+        object.__setattr__(self, 'amount', amount)
+        object.__setattr__(self, 'signature', signature)
+        object.__setattr__(self, 'nonce', nonce)
+        object.__setattr__(self, '_Transaction__transaction_id', None)
 
-    def __init__(self, sender, recipient, signature, amount):
-        self.sender = sender
-        self.recipient = recipient
-        self.amount = amount
-        self.signature = signature
+    def __setattr__(self, name, value):
+        raise AttributeError('Transactions are immutable')
+
+    def __reduce__(self):
+        # Unpickling can't set the attributes of an immutable object, so create it anew
+        return (Transaction, (self.sender, self.recipient, self.signature, self.amount,
+                              self.nonce))
+
+    def intern_addresses(self):
+        """Replace the sender and recipient by their copies in the shared
+        address table and return this transaction.
+
+        Only call this for mined transactions, the table is never cleared.
+        """
+        object.__setattr__(self, 'sender', addresses.intern(self.sender))
+        object.__setattr__(self, 'recipient', addresses.intern(self.recipient))
+        return self
+
+    @property
+    def transaction_id(self):
+        """The id of this transaction: a hash of sender, recipient, amount,
+        signature and nonce (if it has one)."""
+        if self.__transaction_id is None:
+            fields = [self.sender, self.recipient, self.amount, self.signature]
+            if self.nonce is not None:
+                fields.append(self.nonce)
+            object.__setattr__(self, '_Transaction__transaction_id',
+                               hash_string_256(json.dumps(fields).encode()))
+        return self.__transaction_id
 
     def to_ordered_dict(self):
         """Converts this transaction into a (hashable) OrderedDict."""
         return OrderedDict([('sender', self.sender), ('recipient', self.recipient), ('amount', self.amount)])
+
+    def to_dict(self):
+        """Converts this transaction into a (JSON serializable) dictionary."""
+        return {
+            'sender': self.sender,
+            'recipient': self.recipient,
+            'amount': self.amount,
+            'signature': self.signature,
+            'nonce': self.nonce
+        }
+
+    @staticmethod
+    def from_dict(transaction):
+        """Creates a transaction from a dictionary produced by to_dict, raising
+        KeyError if a field is missing and TypeError if it has the wrong type.
+
+        Arguments:
+            :transaction: The dictionary describing the transaction.
+        """
+        return Transaction(field(transaction, 'sender', str), field(transaction, 'recipient', str),
+                           field(transaction, 'signature', str),
+                           field(transaction, 'amount', NUMBER),
+                           field(transaction, 'nonce', str, optional=True))
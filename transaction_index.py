@@ -0,0 +1,109 @@
+from array import array
+
+# Bits of a packed location which hold the position inside the block
+POSITION_BITS = 20
+
+
+class TransactionIndex:
+    """Finds mined transactions by id and by address without walking the chain.
+
+    A location (block height, position in the block) is packed into one
+    integer, height << POSITION_BITS | position, and the locations of an
+    address are kept in an array in chain order, so they take 8 bytes each.
+
+    Identical transactions (e.g. mining rewards for the same address) share
+    their id, which points at the first of them.
+
+    Attributes:
+        :locations: the packed location per transaction id (as bytes).
+        :history: the packed locations per address, oldest first.
+    """
+
+    def __init__(self):
+        self.locations = {}
+        self.history = {}
+        self.height = 0
+
+    @staticmethod
+    def pack(height, position):
+        return height << POSITION_BITS | position
+
+    @staticmethod
+    def unpack(location):
+        return location >> POSITION_BITS, location & ((1 << POSITION_BITS) - 1)
+
+    def clear(self):
+        """Forget every indexed transaction."""
+        self.locations = {}
+        self.history = {}
+        self.height = 0
+
+    def rebuild(self, chain):
+        """Index a whole chain.
+
+        Arguments:
+            :chain: The blocks to index.
+        """
+        self.clear()
+        for block in chain:
+            self.add_block(block)
+
+    def add_block(self, block):
+        """Index the transactions of the block appended to the chain.
+
+        Arguments:
+            :block: The block which was appended to the chain.
+        """
+        for position, tx in enumerate(block.transactions):
+            location = self.pack(block.index, position)
+            self.locations.setdefault(bytes.fromhex(tx.transaction_id), location)
+            for address in {tx.sender, tx.recipient}:
+                locations = self.history.get(address)
+                if locations is None:
+                    locations = self.history[address] = array('Q')
+                locations.append(location)
+        self.height = block.index + 1
+
+    def truncate(self, chain, height):
+        """Forget the blocks of chain from height on (e.g. for a reorganization).
+
+        Arguments:
+            :chain: The chain the blocks were indexed from.
+            :height: The number of blocks which stay.
+        """
+        first_removed = self.pack(height, 0)
+        for block in chain[height:self.height]:
+            for tx in block.transactions:
+                transaction_id = bytes.fromhex(tx.transaction_id)
+                if self.locations.get(transaction_id, -1) >= first_removed:
+                    del self.locations[transaction_id]
+                for address in {tx.sender, tx.recipient}:
+                    locations = self.history.get(address)
+                    while locations and locations[-1] >= first_removed:
+                        locations.pop()
+                    if locations is not None and not locations:
+                        del self.history[address]
+        self.height = min(self.height, height)
+
+    def find(self, transaction_id):
+        """Return the (height, position) of a transaction, or None if it isn't mined.
+
+        Arguments:
+            :transaction_id: The id of the transaction.
+        """
+        try:
+            location = self.locations.get(bytes.fromhex(transaction_id))
+        except ValueError:
+            return None
+        return None if location is None else self.unpack(location)
+
+    def get_history(self, address, limit=None):
+        """Return the (height, position) of the transactions of an address, newest first.
+
+        Arguments:
+            :address: The address (public key) to look up.
+            :limit: The maximum number of locations to return.
+        """
+        locations = self.history.get(address, ())
+        start = 0 if limit is None else max(0, len(locations) - limit)
+        return [self.unpack(location) for location in reversed(locations[start:])]
@@ -0,0 +1,32 @@
+"""Provides interning of addresses (hex encoded public keys)."""
+
+import threading
+
+
+class AddressTable:
+    """Keeps one copy of every address, which the transactions of that
+    address share instead of holding copies of their own.
+
+    The table is never cleared, so only the addresses of mined transactions
+    are interned: they are bounded by the chain, while anyone can send
+    transactions with made-up addresses.
+    """
+
+    def __init__(self):
+        self.__addresses = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__addresses)
+
+    def intern(self, address):
+        """Return the shared copy of an address, adding it to the table if it's new."""
+        shared = self.__addresses.get(address)
+        if shared is None:
+            with self.__lock:
+                shared = self.__addresses.setdefault(address, address)
+        return shared
+
+
+# The table shared by all mined transactions
+addresses = AddressTable()
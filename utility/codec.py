@@ -0,0 +1,139 @@
+"""Provides a compact binary encoding for lists of transactions.
+
+Layout (big-endian): a format byte, the number of distinct addresses
+followed by the addresses, the number of transactions followed by the
+transactions. A transaction refers to its sender and recipient by their
+position in the address list, so each public key is stored once per list.
+Hex strings (keys, signatures) are stored as raw bytes, which halves them.
+Lists holding a transaction with a nonce use NONCE_FORMAT, which stores an
+(optional) nonce after each signature.
+"""
+
+import json
+import struct
+
+from transaction import Transaction
+
+BINARY_FORMAT = 1
+NONCE_FORMAT = 2
+COUNT = struct.Struct('>I')
+ADDRESS_REFERENCES = struct.Struct('>II')
+# Kinds of encoded strings
+HEX_STRING = 0
+TEXT_STRING = 1
+MISSING_STRING = 2
+# Kinds of encoded amounts
+INT_AMOUNT = 0
+FLOAT_AMOUNT = 1
+JSON_AMOUNT = 2
+INT_VALUE = struct.Struct('>q')
+FLOAT_VALUE = struct.Struct('>d')
+
+
+def encode_string(string):
+    """Encode a string, as raw bytes if it is lower case hex (None is
+    encoded as a missing string), raising ValueError for anything else."""
+    if string is None:
+        return bytes([MISSING_STRING]) + COUNT.pack(0)
+    if not isinstance(string, str):
+        raise ValueError('Only strings can be encoded')
+    try:
+        data = bytes.fromhex(string)
+        if data.hex() != string:
+            raise ValueError
+        kind = HEX_STRING
+    except ValueError:
+        data = string.encode('utf-8')
+        kind = TEXT_STRING
+    return bytes([kind]) + COUNT.pack(len(data)) + data
+
+
+def decode_string(data, position):
+    """Decode the string at position, returning it and the position after it."""
+    kind = data[position]
+    length = COUNT.unpack_from(data, position + 1)[0]
+    start = position + 1 + COUNT.size
+    raw = data[start:start + length]
+    if kind == MISSING_STRING:
+        return None, start + length
+    string = raw.hex() if kind == HEX_STRING else raw.decode('utf-8')
+    return string, start + length
+
+
+def encode_amount(amount):
+    """Encode an amount keeping its type, so JSON output stays the same."""
+    if isinstance(amount, int) and not isinstance(amount, bool) and -2 ** 63 <= amount < 2 ** 63:
+        return bytes([INT_AMOUNT]) + INT_VALUE.pack(amount)
+    if isinstance(amount, float):
+        return bytes([FLOAT_AMOUNT]) + FLOAT_VALUE.pack(amount)
+    return bytes([JSON_AMOUNT]) + encode_string(json.dumps(amount))
+
+
+def decode_amount(data, position):
+    """Decode the amount at position, returning it and the position after it."""
+    kind = data[position]
+    if kind == INT_AMOUNT:
+        return INT_VALUE.unpack_from(data, position + 1)[0], position + 1 + INT_VALUE.size
+    if kind == FLOAT_AMOUNT:
+        return FLOAT_VALUE.unpack_from(data, position + 1)[0], position + 1 + FLOAT_VALUE.size
+    text, position = decode_string(data, position + 1)
+    return json.loads(text), position
+
+
+def encode_transactions(transactions):
+    """Encode a list of transactions into bytes.
+
+    Arguments:
+        :transactions: The transactions to encode.
+    """
+    address_positions = {}
+    for tx in transactions:
+        for address in (tx.sender, tx.recipient):
+            address_positions.setdefault(address, len(address_positions))
+    # Lists without nonces keep the format older versions can read
+    encoding = BINARY_FORMAT
+    if any(tx.nonce is not None for tx in transactions):
+        encoding = NONCE_FORMAT
+    parts = [bytes([encoding]), COUNT.pack(len(address_positions))]
+    parts.extend(encode_string(address) for address in address_positions)
+    parts.append(COUNT.pack(len(transactions)))
+    for tx in transactions:
+        parts.append(ADDRESS_REFERENCES.pack(address_positions[tx.sender],
+                                             address_positions[tx.recipient]))
+        parts.append(encode_amount(tx.amount))
+        parts.append(encode_string(tx.signature))
+        if encoding == NONCE_FORMAT:
+            parts.append(encode_string(tx.nonce))
+    return b''.join(parts)
+
+
+def decode_transactions(data):
+    """Decode bytes produced by encode_transactions into a list of transactions.
+
+    Arguments:
+        :data: The encoded transactions.
+    """
+    encoding = data[0]
+    if encoding not in (BINARY_FORMAT, NONCE_FORMAT):
+        raise ValueError('Unknown transaction encoding')
+    position = 1
+    address_count = COUNT.unpack_from(data, position)[0]
+    position += COUNT.size
+    address_list = []
+    for _ in range(address_count):
+        address, position = decode_string(data, position)
+        address_list.append(address)
+    transaction_count = COUNT.unpack_from(data, position)[0]
+    position += COUNT.size
+    transactions = []
+    for _ in range(transaction_count):
+        sender, recipient = ADDRESS_REFERENCES.unpack_from(data, position)
+        position += ADDRESS_REFERENCES.size
+        amount, position = decode_amount(data, position)
+        signature, position = decode_string(data, position)
+        nonce = None
+        if encoding == NONCE_FORMAT:
+            nonce, position = decode_string(data, position)
+        transactions.append(Transaction(address_list[sender], address_list[recipient],
+                                        signature, amount, nonce))
+    return transactions
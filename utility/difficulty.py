@@ -0,0 +1,58 @@
+"""Provides the proof of work difficulty and its retargeting rule.
+
+The difficulty is the number of leading zero bits a proof hash needs.
+"""
+
+# Difficulty of blocks which were created before it was recorded ('00' in hex)
+DEFAULT_DIFFICULTY = 8
+MIN_DIFFICULTY = 4
+MAX_DIFFICULTY = 64
+# Seconds we'd like to pass between two blocks
+TARGET_BLOCK_INTERVAL = 60
+# Number of recent blocks whose timestamps are used for retargeting
+RETARGET_WINDOW = 10
+
+
+def block_difficulty(block):
+    """Return the difficulty a block was mined with."""
+    return DEFAULT_DIFFICULTY if block.difficulty is None else block.difficulty
+
+
+def meets_difficulty(digest, difficulty):
+    """Check whether a raw hash digest has difficulty leading zero bits."""
+    return int.from_bytes(digest, 'big') >> (len(digest) * 8 - difficulty) == 0
+
+
+def next_difficulty(chain, height):
+    """Return the difficulty the block at height has to be mined with.
+
+    The difficulty goes up by one bit if the recent blocks came in faster than
+    half the target interval and down by one bit if they took more than twice
+    as long. The genesis block is never part of the window since its timestamp
+    is fixed.
+
+    Arguments:
+        :chain: The blockchain (at least up to height - 1).
+        :height: The index of the block to be mined.
+    """
+    difficulty = block_difficulty(chain[height - 1])
+    first = max(1, height - RETARGET_WINDOW)
+    if height - 1 - first < 1:
+        return difficulty
+    average_interval = (chain[height - 1].timestamp -
+                        chain[first].timestamp) / (height - 1 - first)
+    if average_interval < TARGET_BLOCK_INTERVAL / 2:
+        difficulty += 1
+    elif average_interval > TARGET_BLOCK_INTERVAL * 2:
+        difficulty -= 1
+    return min(MAX_DIFFICULTY, max(MIN_DIFFICULTY, difficulty))
+
+
+def chain_work(blocks):
+    """Return the total work of blocks (the number of hashes they took on
+    average), by which two branches of the chain are compared.
+
+    Arguments:
+        :blocks: The blocks to add up.
+    """
+    return sum(1 << block_difficulty(block) for block in blocks)
@@ -0,0 +1,60 @@
+"""Provides an in-process event bus with a bounded history."""
+
+from collections import deque, namedtuple
+import threading
+
+# An event: its sequence number, its kind, the chain height when it was
+# published and its data
+Event = namedtuple('Event', ['sequence', 'kind', 'height', 'data'])
+
+
+class EventBus:
+    """Hands published events to any number of subscribers, which wait for
+    the events after the last sequence number they have seen.
+
+    Attributes:
+        :history: the number of recent events kept for slow subscribers.
+    """
+
+    def __init__(self, history=1000):
+        self.history = history
+        self.__events = deque(maxlen=history)
+        self.__sequence = 0
+        self.__condition = threading.Condition()
+
+    @property
+    def sequence(self):
+        """The sequence number of the last published event."""
+        with self.__condition:
+            return self.__sequence
+
+    def publish(self, kind, height, data):
+        """Publish an event and wake up the waiting subscribers.
+
+        Arguments:
+            :kind: The kind of the event (e.g. 'block').
+            :height: The chain height when the event happened.
+            :data: The payload of the event.
+        """
+        with self.__condition:
+            self.__sequence += 1
+            self.__events.append(Event(self.__sequence, kind, height, data))
+            self.__condition.notify_all()
+
+    def wait(self, after, timeout=None):
+        """Return the events published after the sequence number after,
+        waiting up to timeout seconds for one (an empty list if none came).
+
+        Returns None if some of the events were dropped from the history.
+
+        Arguments:
+            :after: The sequence number of the last event seen.
+            :timeout: The maximum number of seconds to wait.
+        """
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__sequence > after, timeout)
+            if self.__sequence <= after:
+                return []
+            if not self.__events or self.__events[0].sequence > after + 1:
+                return None
+            return [event for event in self.__events if event.sequence > after]
@@ -0,0 +1,34 @@
+"""Provides type checks for the fields of data received from clients and peers."""
+
+# Types of the numeric fields (bools are ints in Python, but not numbers here)
+INTEGER = (int,)
+NUMBER = (int, float)
+
+
+def field(data, name, types, optional=False):
+    """Return a field of a dictionary, raising KeyError if it is missing
+    (unless it is optional, then it defaults to None) and TypeError if it
+    isn't one of types.
+
+    Arguments:
+        :data: The dictionary holding the field.
+        :name: The name of the field.
+        :types: A type or a tuple of the types the value may have.
+        :optional: Whether the field may be missing or None.
+    """
+    value = data.get(name) if optional else data[name]
+    if value is None and optional:
+        return None
+    if not has_type(value, types):
+        raise TypeError(f'Field {name} has the wrong type')
+    return value
+
+
+def has_type(value, types):
+    """Check whether value is one of types (a bool is neither an INTEGER nor a NUMBER).
+
+    Arguments:
+        :value: The value to check.
+        :types: A type or a tuple of the types the value may have.
+    """
+    return not isinstance(value, bool) and isinstance(value, types)
@@ -0,0 +1,36 @@
+"""Provides cheap read-only snapshots of append-only lists."""
+
+
+class FrozenView:
+    """A read-only view of the first items of a list which is only ever
+    appended to. Items appended later are not visible, so the view behaves like
+    a copy taken at creation time without copying anything.
+
+    Lists which need to drop or reorder items have to be replaced by a new
+    list instead, which leaves existing views untouched.
+    """
+    __slots__ = ('__items', '__length')
+
+    def __init__(self, items, length=None):
+        self.__items = items
+        self.__length = len(items) if length is None else length
+
+    def __len__(self):
+        return self.__length
+
+    def __iter__(self):
+        items = self.__items
+        for index in range(self.__length):
+            yield items[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.__items[position] for position in range(*index.indices(self.__length))]
+        if index < 0:
+            index += self.__length
+        if not 0 <= index < self.__length:
+            raise IndexError('view index out of range')
+        return self.__items[index]
+
+    def __repr__(self):
+        return repr(self[:])
@@ -11,13 +11,43 @@ def hash_string_256(string):
     return hl.sha256(string).hexdigest()
 
 
+def header_prefix(index, previous_hash, timestamp, merkle_root, difficulty):
+    """Return the serialized header of a block with a Merkle root up to its
+    proof, which comes last (so a proof of work search hashes this only once).
+
+    Arguments:
+        :index: The index of the block.
+        :previous_hash: The hash of the previous block.
+        :timestamp: The timestamp of the block.
+        :merkle_root: The Merkle root of the block's transactions.
+        :difficulty: The difficulty the block is mined with.
+    """
+    return json.dumps([index, previous_hash, timestamp, merkle_root, difficulty]).encode()
+
+
 def hash_block(block):
     """Hashes a block and returns a string representation of it.
 
+    Blocks with a Merkle root are hashed over their header alone (the header
+    prefix followed by the proof), older blocks over all of their
+    transactions. This always hashes the block, use block.hash for the cached
+    hash.
+
     Arguments:
         :block: The block that should be hashed.
     """
-    hashable_block = block.__dict__.copy()
-    hashable_block['transactions'] = [tx.to_ordered_dict()
-                                      for tx in hashable_block['transactions']]
+    if block.merkle_root is not None:
+        return hash_string_256(header_prefix(block.index, block.previous_hash, block.timestamp,
+                                             block.merkle_root, block.difficulty) +
+                               str(block.proof).encode())
+    hashable_block = {
+        'index': block.index,
+        'previous_hash': block.previous_hash,
+        'timestamp': block.timestamp,
+        'transactions': [tx.to_ordered_dict() for tx in block.transactions],
+        'proof': block.proof
+    }
+    # Blocks mined before the difficulty was recorded were hashed without it
+    if block.difficulty is not None:
+        hashable_block['difficulty'] = block.difficulty
     return hash_string_256(json.dumps(hashable_block, sort_keys=True).encode())
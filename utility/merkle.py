@@ -0,0 +1,79 @@
+"""Provides Merkle trees over the transaction ids of a block.
+
+Leaves and inner nodes are hashed with different prefixes (as in RFC 6962),
+so a leaf can't pose as an inner node. A node without a sibling is carried up
+to the next level as it is, so no transaction is counted twice.
+"""
+
+import hashlib as hl
+
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def hash_leaf(transaction_id):
+    return hl.sha256(LEAF_PREFIX + bytes.fromhex(transaction_id)).digest()
+
+
+def hash_node(left, right):
+    return hl.sha256(NODE_PREFIX + left + right).digest()
+
+
+def merkle_root(transaction_ids):
+    """Return the Merkle root (hex) of a list of transaction ids.
+
+    Arguments:
+        :transaction_ids: The ids of the transactions, in block order.
+    """
+    level = [hash_leaf(transaction_id) for transaction_id in transaction_ids]
+    if not level:
+        return hl.sha256(b'').hexdigest()
+    while len(level) > 1:
+        level = [hash_node(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+def merkle_proof(transaction_ids, position):
+    """Return the proof that the transaction at position is part of the tree:
+    the siblings on the way to the root as {'side': 'left' or 'right' of the
+    path, 'hash': hex} dictionaries.
+
+    Arguments:
+        :transaction_ids: The ids of the transactions, in block order.
+        :position: The position of the transaction to prove.
+    """
+    level = [hash_leaf(transaction_id) for transaction_id in transaction_ids]
+    proof = []
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append({'side': 'left' if sibling < position else 'right',
+                          'hash': level[sibling].hex()})
+        level = [hash_node(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+        position //= 2
+    return proof
+
+
+def verify_merkle_proof(transaction_id, proof, root):
+    """Check a proof returned by merkle_proof against a Merkle root.
+
+    Arguments:
+        :transaction_id: The id of the transaction which is proven.
+        :proof: The steps of the proof (as returned by merkle_proof).
+        :root: The Merkle root (hex) from the block header.
+    """
+    try:
+        current = hash_leaf(transaction_id)
+        for step in proof:
+            sibling = bytes.fromhex(step['hash'])
+            if step['side'] == 'left':
+                current = hash_node(sibling, current)
+            elif step['side'] == 'right':
+                current = hash_node(current, sibling)
+            else:
+                return False
+    except (KeyError, TypeError, ValueError):
+        return False
+    return current.hex() == root
@@ -0,0 +1,199 @@
+"""Provides counters, latency histograms and a sampling profiler.
+
+The metrics are rendered in the Prometheus text format. Every process
+keeps its own values, so with several worker processes each reports its own.
+"""
+
+from bisect import bisect_left
+from collections import Counter as Tally
+from contextlib import contextmanager
+import os
+import sys
+import threading
+from time import perf_counter
+
+# Upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    """Render label pairs as {name="value",...} (nothing if there are none)."""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"'
+                          for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Counter:
+    """A value which only goes up, per combination of labels."""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.__values = {}
+        self.__lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Add amount to the counter with the given labels."""
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            self.__values[key] = self.__values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.__lock:
+            values = sorted(self.__values.items())
+        lines.extend(f'{self.name}{format_labels(labels)} {value}' for labels, value in values)
+        return lines
+
+
+class Histogram:
+    """Counts observed values (e.g. latencies) in buckets, per combination of labels."""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # Per labels: [count per bucket (the last one is +Inf), sum]
+        self.__values = {}
+        self.__lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Record a value for the given labels."""
+        key = tuple(sorted(labels.items()))
+        bucket = bisect_left(self.buckets, value)
+        with self.__lock:
+            entry = self.__values.get(key)
+            if entry is None:
+                entry = self.__values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bucket] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds the with block takes."""
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.__lock:
+            values = sorted((labels, list(counts), total)
+                            for labels, (counts, total) in self.__values.items())
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(labels + (("le", bound),))} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """Holds the metrics of a process and renders them all."""
+
+    def __init__(self):
+        self.__metrics = {}
+        self.__lock = threading.Lock()
+
+    def __get(self, metric_class, name, *args):
+        with self.__lock:
+            if name not in self.__metrics:
+                self.__metrics[name] = metric_class(name, *args)
+            return self.__metrics[name]
+
+    def counter(self, name, help_text):
+        """Return the counter with the given name, creating it if needed."""
+        return self.__get(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        """Return the histogram with the given name, creating it if needed."""
+        return self.__get(Histogram, name, help_text, buckets)
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        with self.__lock:
+            metrics = sorted(self.__metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads of the process at a fixed interval.
+
+    The result is in the collapsed stack format ('outer;inner count' per
+    line) which flame graph tools read.
+
+    Attributes:
+        :interval: the seconds between two samples.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.__stacks = Tally()
+        self.__samples = 0
+        self.__thread = None
+        self.__stop = threading.Event()
+        self.__lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.__thread is not None
+
+    def start(self):
+        """Start sampling (from scratch)."""
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            self.__stacks = Tally()
+            self.__samples = 0
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__run, daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        """Stop sampling, keeping the samples taken."""
+        with self.__lock:
+            thread = self.__thread
+            self.__thread = None
+        if thread is not None:
+            self.__stop.set()
+            thread.join()
+
+    def __run(self):
+        me = threading.get_ident()
+        while not self.__stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(stack)))
+            with self.__lock:
+                self.__stacks.update(stacks)
+                self.__samples += 1
+
+    def report(self):
+        """Return the number of samples and the collapsed stacks, most frequent first."""
+        with self.__lock:
+            stacks = self.__stacks.most_common()
+            samples = self.__samples
+        return samples, ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+
+# Metrics of this process
+registry = Registry()
@@ -2,5 +2,7 @@
 
 class Printable:
     """A base class which implements printing functionality"""
+    __slots__ = ()
+
     def __repr__(self):
-        return str(self.__dict__)
+        return str(self.to_dict())
@@ -0,0 +1,55 @@
+"""Provides a fast proof of work search over a precomputed hashing prefix."""
+
+import hashlib as hl
+
+from utility.difficulty import DEFAULT_DIFFICULTY
+
+
+def proof_prefix(transactions, last_hash):
+    """Return the part of a proof of work guess which doesn't depend on the proof.
+
+    Arguments:
+        :transactions: The transactions of the block for which the proof is created.
+        :last_hash: The previous block's hash which will be stored in the current block.
+    """
+    return (str([tx.to_ordered_dict() for tx in transactions]) + str(last_hash)).encode()
+
+
+class ProofSearch:
+    """Tests proof of work numbers for one block.
+
+    Everything the proof is hashed with (the prefix) is serialized and hashed
+    only once, every proof then only hashes its own digits on top of a copy of
+    that state.
+    """
+
+    def __init__(self, prefix, difficulty=DEFAULT_DIFFICULTY):
+        self.__prefix_state = hl.sha256(prefix)
+        # A digest read as a number has to stay below this target
+        self.__target = 1 << (256 - difficulty)
+
+    @classmethod
+    def for_block(cls, transactions, last_hash, difficulty=DEFAULT_DIFFICULTY):
+        """Create a search for the block holding transactions on top of last_hash."""
+        return cls(proof_prefix(transactions, last_hash), difficulty)
+
+    def is_valid(self, proof):
+        """Check whether a proof solves the puzzle (enough leading zero bits).
+
+        Arguments:
+            :proof: The proof number we're testing.
+        """
+        state = self.__prefix_state.copy()
+        state.update(str(proof).encode())
+        return int.from_bytes(state.digest(), 'big') < self.__target
+
+    def search(self, start, stop):
+        """Return the first valid proof in range(start, stop) or None."""
+        prefix_state = self.__prefix_state
+        target = self.__target
+        for proof in range(start, stop):
+            state = prefix_state.copy()
+            state.update(str(proof).encode())
+            if int.from_bytes(state.digest(), 'big') < target:
+                return proof
+        return None
@@ -0,0 +1,68 @@
+"""Provides a reader/writer lock."""
+
+from contextlib import contextmanager
+import threading
+
+
+class ReadWriteLock:
+    """A lock which lets any number of readers in at once, but writers only
+    alone. Waiting writers keep new readers out, so they can't starve.
+
+    Both sides are reentrant, and the thread holding the write lock may also
+    take the read lock.
+    """
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__readers = 0
+        self.__writer = None
+        self.__writer_depth = 0
+        self.__waiting_writers = 0
+        self.__local = threading.local()
+
+    def __read_depth(self):
+        return getattr(self.__local, 'read_depth', 0)
+
+    @contextmanager
+    def read_lock(self):
+        """Hold the lock as a reader for the duration of a with block."""
+        me = threading.get_ident()
+        depth = self.__read_depth()
+        if depth == 0 and self.__writer != me:
+            with self.__condition:
+                while self.__writer is not None or self.__waiting_writers:
+                    self.__condition.wait()
+                self.__readers += 1
+        self.__local.read_depth = depth + 1
+        try:
+            yield
+        finally:
+            self.__local.read_depth = depth
+            if depth == 0 and self.__writer != me:
+                with self.__condition:
+                    self.__readers -= 1
+                    if self.__readers == 0:
+                        self.__condition.notify_all()
+
+    @contextmanager
+    def write_lock(self):
+        """Hold the lock as the only writer for the duration of a with block."""
+        me = threading.get_ident()
+        with self.__condition:
+            if self.__writer != me:
+                if self.__read_depth():
+                    raise RuntimeError('Cannot upgrade a read lock to a write lock')
+                self.__waiting_writers += 1
+                while self.__writer is not None or self.__readers:
+                    self.__condition.wait()
+                self.__waiting_writers -= 1
+                self.__writer = me
+            self.__writer_depth += 1
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__writer_depth -= 1
+                if self.__writer_depth == 0:
+                    self.__writer = None
+                    self.__condition.notify_all()
@@ -0,0 +1,55 @@
+"""Provides a bounded cache of successfully verified transaction signatures."""
+
+from collections import OrderedDict
+import threading
+
+
+class SignatureCache:
+    """Remembers the ids of transactions whose signature was verified, evicting
+    the least recently used ids once the cache is full. It can be used from
+    several threads at once.
+
+    Attributes:
+        :maxsize: the maximum number of remembered transaction ids.
+        :hits: the number of lookups which found a verified transaction.
+        :misses: the number of lookups which didn't.
+        :evictions: the number of ids dropped to respect maxsize.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__verified = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__verified)
+
+    def is_verified(self, transaction_id):
+        """Check whether the transaction with this id was verified already."""
+        with self.__lock:
+            if transaction_id in self.__verified:
+                self.__verified.move_to_end(transaction_id)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, transaction_id):
+        """Remember that the transaction with this id has a valid signature."""
+        with self.__lock:
+            self.__verified[transaction_id] = True
+            self.__verified.move_to_end(transaction_id)
+            while len(self.__verified) > self.maxsize:
+                self.__verified.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Forget all verified transactions and reset the counters."""
+        with self.__lock:
+            self.__verified.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
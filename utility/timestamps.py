@@ -0,0 +1,50 @@
+"""Provides the rules the timestamps of blocks have to follow.
+
+Retargeting the difficulty relies on the timestamps, so a miner can't pick
+them freely: a block has to be later than the median of the recent blocks
+and may only be a bounded amount of time ahead of our clock.
+"""
+
+from statistics import median
+from time import time
+
+# Number of recent blocks whose median timestamp a new block has to exceed
+MEDIAN_TIME_SPAN = 11
+# Seconds a block's timestamp may be ahead of our clock
+MAX_FUTURE_DRIFT = 2 * 60 * 60
+
+
+def median_time_past(chain, height):
+    """Return the median timestamp of the (up to MEDIAN_TIME_SPAN) blocks before height.
+
+    Arguments:
+        :chain: The blockchain (at least up to height - 1).
+        :height: The index of the block which follows them.
+    """
+    return median(block.timestamp for block in chain[max(0, height - MEDIAN_TIME_SPAN):height])
+
+
+def valid_timestamp(chain, height, timestamp, now=None):
+    """Check whether timestamp is valid for the block at height.
+
+    Arguments:
+        :chain: The blockchain (at least up to height - 1).
+        :height: The index of the block.
+        :timestamp: The timestamp of the block.
+        :now: The current time (defaults to our clock).
+    """
+    now = time() if now is None else now
+    return median_time_past(chain, height) < timestamp <= now + MAX_FUTURE_DRIFT
+
+
+def next_timestamp(chain, height, now=None):
+    """Return the timestamp for a block mined at height now, which is moved
+    past the median of the recent blocks if our clock is behind them.
+
+    Arguments:
+        :chain: The blockchain (at least up to height - 1).
+        :height: The index of the block to be mined.
+        :now: The current time (defaults to our clock).
+    """
+    now = time() if now is None else now
+    return max(now, median_time_past(chain, height) + 1)
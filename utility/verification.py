@@ -1,6 +1,13 @@
 """Provides verification helper methods."""
 
-from utility.hash_util import hash_string_256, hash_block
+import hashlib as hl
+
+from utility.difficulty import DEFAULT_DIFFICULTY, block_difficulty, meets_difficulty, \
+    next_difficulty
+from utility.fields import NUMBER, has_type
+from utility.merkle import merkle_root
+from utility.hash_util import hash_block
+from utility.timestamps import valid_timestamp
 from wallet import Wallet
 
 
@@ -8,43 +15,116 @@ class Verification:
     """A helper class which offer various static and class-based verification methods"""
 
     @staticmethod
-    def valid_proof(transactions, last_hash, proof):
-        """Validate proof of work number and see if it solves the puzzle algorithm (two leading 0s)
+    def valid_proof(transactions, last_hash, proof, difficulty=DEFAULT_DIFFICULTY):
+        """Validate proof of work number and see if it solves the puzzle algorithm
+        (difficulty leading zero bits, the default being two leading 0s in hex)
 
         Arguments:
             :transactions: The transactions of the block for which the proof is created.
             :last_hash: The previous block's hash which will be stored in the current block.
             :proof: The proof number we're testing.
+            :difficulty: The number of leading zero bits the hash needs.
         """
         guess = (str([tx.to_ordered_dict() for tx in transactions]) +
                  str(last_hash) + str(proof)).encode()
-        guess_hash = hash_string_256(guess)
-        # Chech first two characters of hash string
-        return guess_hash[0:2] == '00'
+        return meets_difficulty(hl.sha256(guess).digest(), difficulty)
+
+    @staticmethod
+    def valid_header_proof(block):
+        """Validate the proof of work of a block with a Merkle root, which is
+        its hash: the whole header, with the proof last, has to hash to
+        enough leading zero bits.
+
+        Arguments:
+            :block: The block we're testing.
+        """
+        return meets_difficulty(bytes.fromhex(block.hash), block_difficulty(block))
 
     @classmethod
-    def verify_chain(cls, blockchain):
-        """ Verify the current blockchain and return True if it's valid, False otherwise."""
-        for (index, block) in enumerate(blockchain):
-            if index == 0:
+    def verify_chain(cls, blockchain, start=1, legacy_height=None):
+        """ Verify the current blockchain and return True if it's valid, False otherwise.
+
+        Arguments:
+            :blockchain: The blocks to verify.
+            :start: The index of the first block to verify, the blocks before are trusted.
+            :legacy_height: The index from which on blocks have to record their
+                difficulty and Merkle root. Only blocks which were stored
+                before these were recorded may lack them, so pass the index
+                of the first block received from a peer (default: no limit).
+        """
+        for index in range(max(1, start), len(blockchain)):
+            block = blockchain[index]
+            if block.index != index or block.previous_hash != blockchain[index - 1].hash:
+                return False
+            if not valid_timestamp(blockchain, index, block.timestamp):
+                print('Timestamp is invalid')
+                return False
+            if block.difficulty is None:
+                # Only blocks from before difficulties were recorded may lack one
+                if ((legacy_height is not None and index >= legacy_height) or
+                        blockchain[index - 1].difficulty is not None):
+                    print('Difficulty is missing')
+                    return False
+            elif block.difficulty != next_difficulty(blockchain, index):
+                print('Difficulty is invalid')
+                return False
+            if block.merkle_root is not None:
+                if not block.pruned and block.merkle_root != merkle_root(
+                        [tx.transaction_id for tx in block.transactions]):
+                    print('Merkle root is invalid')
+                    return False
+                # The hash of a pruned block is stored, but it can still be checked
+                if block.pruned and block.hash != hash_block(block):
+                    print('Block hash is invalid')
+                    return False
+                if not cls.valid_header_proof(block):
+                    print('Proof of work is invalid')
+                    return False
                 continue
-            if block.previous_hash != hash_block(blockchain[index - 1]):
+            # Only blocks from before Merkle roots were recorded may lack one
+            if ((legacy_height is not None and index >= legacy_height) or
+                    blockchain[index - 1].merkle_root is not None):
+                print('Merkle root is missing')
                 return False
-            if not cls.valid_proof(block.transactions[:-1], block.previous_hash, block.proof):
+            if block.pruned:
+                # Only the header of a pruned block is left, so only its link is checked
+                continue
+            if not cls.valid_proof(block.transactions[:-1], block.previous_hash, block.proof,
+                                   block_difficulty(block)):
                 print('Proof of work is invalid')
                 return False
+        # The last transaction of every block is the (unsigned) mining reward
+        signed_transactions = [tx for block in blockchain[max(1, start):]
+                               for tx in block.transactions[:-1]]
+        if not all(Wallet.verify_transactions(signed_transactions, short_circuit=True)):
+            print('Transaction signature is invalid')
+            return False
         return True
 
+    @staticmethod
+    def valid_fields(transaction):
+        """Check that the fields of a transaction have types it can be stored with.
+
+        Arguments:
+            :transaction: The transaction to check.
+        """
+        return (has_type(transaction.sender, str) and has_type(transaction.recipient, str) and
+                has_type(transaction.signature, str) and has_type(transaction.amount, NUMBER) and
+                (transaction.nonce is None or has_type(transaction.nonce, str)))
+
     @staticmethod
     def verify_transaction(transaction, get_balance, check_funds=True):
         """Verify a transaction by checking whether the sender has sufficient coins."""
+        if not Verification.valid_fields(transaction):
+            return False
         if check_funds:
-            sender_balance = get_balance()
-            return sender_balance >= transaction.amount and Wallet.verify_transaction(transaction)
+            sender_balance = get_balance(transaction.sender)
+            return (sender_balance >= transaction.amount and
+                    Wallet.verify_transactions([transaction])[0])
         else:
-            return Wallet.verify_transaction(transaction)
+            return Wallet.verify_transactions([transaction])[0]
 
-    @classmethod
-    def verify_transactions(cls, open_transactions, get_balance):
+    @staticmethod
+    def verify_transactions(open_transactions, get_balance):
         """Verifies all open transactions"""
-        return all([cls.verify_transaction(tx, get_balance, False) for tx in open_transactions])
+        return all(Wallet.verify_transactions(open_transactions, short_circuit=True))
@@ -1,26 +1,90 @@
 import binascii
+import json
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import lru_cache
+import os
+
 from Crypto.PublicKey import RSA
 from Crypto.Signature import PKCS1_v1_5
 from Crypto.Hash import SHA256
 import Crypto.Random
 
+from utility.metrics import registry
+from utility.signature_cache import SignatureCache
+
+# Number of processes verifying signatures in parallel
+SIGNATURE_WORKERS = os.cpu_count() or 1
+# Smaller batches are verified in this process, a pool wouldn't pay off
+MIN_PARALLEL_BATCH = 64
+# Process pool used by Wallet.verify_transactions (created on first use)
+verification_pool = None
+# Ids of transactions whose signature was verified already
+verified_signatures = SignatureCache(maxsize=100000)
+verification_seconds = registry.histogram('signature_verification_seconds',
+                                          'Seconds spent verifying a batch of signatures.')
+verification_results = registry.counter('signatures_verified_total',
+                                        'Signatures checked, by result (cached, valid, invalid).')
+
+
+@lru_cache(maxsize=1024)
+def import_public_key(public_key):
+    """Return the parsed RSA key for a hex encoded public key (cached per sender)."""
+    return RSA.importKey(binascii.unhexlify(public_key))
+
+
+def signed_payload(sender, recipient, amount, nonce=None):
+    """Return the hash which is signed for a transaction.
+
+    Transactions without a nonce (created before nonces were introduced)
+    keep the plain concatenation they were signed with, a nonce is only
+    signed in an unambiguous JSON encoding.
+    """
+    if nonce is None:
+        return SHA256.new((str(sender) + str(recipient) + str(amount)).encode('utf-8'))
+    return SHA256.new(json.dumps([sender, recipient, amount, nonce]).encode('utf-8'))
+
+
+def verify_signatures(transactions, short_circuit=False):
+    """Verify the signatures of several transactions and return the results.
+
+    Arguments:
+        :transactions: The transactions to verify.
+        :short_circuit: Stop at the first invalid signature, the remaining
+            transactions are reported as invalid.
+    """
+    results = []
+    for transaction in transactions:
+        valid = Wallet.verify_transaction(transaction)
+        results.append(valid)
+        if short_circuit and not valid:
+            results.extend([False] * (len(transactions) - len(results)))
+            break
+    return results
+
 
 class Wallet:
     """Wallet class"""
 
-    def __init__(self):
+    def __init__(self, filename='wallet.txt'):
+        self.filename = filename
         self.private_key = None
         self.public_key = None
+        # Signer for the parsed private key, so it isn't parsed per signature
+        self.__signer = None
 
-    def create_keys(self):
-        private_key, public_key = self.generate_keys()
+    def __set_keys(self, private_key, public_key):
+        self.__signer = PKCS1_v1_5.new(RSA.importKey(binascii.unhexlify(private_key)))
         self.private_key = private_key
         self.public_key = public_key
 
+    def create_keys(self, randfunc=None):
+        private_key, public_key = self.generate_keys(randfunc)
+        self.__set_keys(private_key, public_key)
+
     def save_keys(self):
         if self.public_key is not None and self.private_key is not None:
             try:
-                with open('wallet.txt', mode='w', encoding='utf-8') as file:
+                with open(self.filename, mode='w', encoding='utf-8') as file:
                     file.write(self.public_key)
                     file.write('\n')
                     file.write(self.private_key)
@@ -31,35 +95,104 @@ class Wallet:
 
     def load_keys(self):
         try:
-            with open('wallet.txt', mode='r', encoding='utf-8') as file:
+            with open(self.filename, mode='r', encoding='utf-8') as file:
                 keys = file.readlines()
                 public_key = keys[0][:-1]
                 private_key = keys[1]
-                self.public_key = public_key
-                self.private_key = private_key
+                self.__set_keys(private_key, public_key)
             return True
-        except (IOError, IndexError):
+        except (IOError, IndexError, ValueError):
             print('Loading wallet failed...')
             return False
 
-    def generate_keys(self):
-        private_key = RSA.generate(1024, Crypto.Random.new().read)
+    def generate_keys(self, randfunc=None):
+        """Generate a key pair (from randfunc, a function returning n random
+        bytes, if given, e.g. for reproducible benchmarks)."""
+        private_key = RSA.generate(1024, Crypto.Random.new().read if randfunc is None else randfunc)
         public_key = private_key.public_key()
         return (binascii.hexlify(private_key.exportKey(format='DER')).decode('ascii'), binascii.hexlify(public_key.exportKey(format='DER')).decode('ascii'))
 
-    def sign_transaction(self, sender, recipient, amount):
-        signer = PKCS1_v1_5.new(RSA.importKey(
-            binascii.unhexlify(self.private_key)))
-        h = SHA256.new((str(sender) + str(recipient) +
-                       str(amount)).encode('utf-8'))
-        signature = signer.sign(h)
+    def sign_transaction(self, sender, recipient, amount, nonce=None):
+        signature = self.__signer.sign(signed_payload(sender, recipient, amount, nonce))
         return binascii.hexlify(signature).decode('ascii')
 
+    def sign_transactions(self, sender, payments):
+        """Sign several transactions.
+
+        Arguments:
+            :sender: The sender of the transactions.
+            :payments: (recipient, amount, nonce) tuples, one per transaction.
+        """
+        return [self.sign_transaction(sender, recipient, amount, nonce)
+                for recipient, amount, nonce in payments]
+
     @staticmethod
     def verify_transaction(transaction):
-        """Verify the signature of a transaction."""
-        public_key = RSA.importKey(binascii.unhexlify(transaction.sender))
-        verifier = PKCS1_v1_5.new(public_key)
-        h = SHA256.new((str(transaction.sender) + str(transaction.recipient) +
-                       str(transaction.amount)).encode('utf-8'))
-        return verifier.verify(h, binascii.unhexlify(transaction.signature))
+        """Verify the signature of a transaction (a malformed key or signature
+        makes it invalid)."""
+        try:
+            public_key = import_public_key(transaction.sender)
+            verifier = PKCS1_v1_5.new(public_key)
+            h = signed_payload(transaction.sender, transaction.recipient,
+                               transaction.amount, transaction.nonce)
+            return verifier.verify(h, binascii.unhexlify(transaction.signature))
+        except (ValueError, TypeError):
+            return False
+
+    @staticmethod
+    def verify_transactions(transactions, short_circuit=False):
+        """Verify the signatures of a batch of transactions, spreading large
+        batches across a pool of processes.
+
+        Transactions which were verified before are looked up in the verified
+        signature cache instead of being verified again. Returns a list with one
+        result per transaction.
+
+        Arguments:
+            :transactions: The transactions to verify.
+            :short_circuit: Stop as soon as one invalid signature is found, the
+                transactions which weren't checked are reported as invalid.
+        """
+        with verification_seconds.time():
+            transaction_ids = [tx.transaction_id for tx in transactions]
+            results = [verified_signatures.is_verified(transaction_id)
+                       for transaction_id in transaction_ids]
+            unverified = [index for index, valid in enumerate(results) if not valid]
+            unverified_results = Wallet.__verify_uncached(
+                [transactions[index] for index in unverified], short_circuit)
+            for index, valid in zip(unverified, unverified_results):
+                results[index] = valid
+                if valid:
+                    verified_signatures.add(transaction_ids[index])
+        valid_count = sum(unverified_results)
+        verification_results.inc(len(results) - len(unverified), result='cached')
+        verification_results.inc(valid_count, result='valid')
+        verification_results.inc(len(unverified) - valid_count, result='invalid')
+        return results
+
+    @staticmethod
+    def __verify_uncached(transactions, short_circuit):
+        """Verify the signatures of a batch of transactions without the cache."""
+        if SIGNATURE_WORKERS < 2 or len(transactions) < MIN_PARALLEL_BATCH:
+            return verify_signatures(transactions, short_circuit)
+        global verification_pool
+        if verification_pool is None:
+            verification_pool = ProcessPoolExecutor(SIGNATURE_WORKERS)
+        chunk_size = -(-len(transactions) // SIGNATURE_WORKERS)
+        futures = {verification_pool.submit(verify_signatures,
+                                            transactions[start:start + chunk_size],
+                                            short_circuit): start
+                   for start in range(0, len(transactions), chunk_size)}
+        results = [False] * len(transactions)
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk_results = future.result()
+                start = futures[future]
+                results[start:start + len(chunk_results)] = chunk_results
+                if short_circuit and not all(chunk_results):
+                    for unfinished in pending:
+                        unfinished.cancel()
+                    return results
+        return results